@@ -0,0 +1,159 @@
+"""
+IndieAuthify: benchmarks; client_id page parsing benchmark
+
+Compares parsing client_id pages the way the server used to, with a
+BeautifulSoup parse for the rel=redirect_uri links and a second, html5lib, parse
+by indieweb_utils for the h-app, against the single pass parser it now uses, and
+checks that both find the same h-app and redirect URIs. The pages are generated
+to look like large real world client pages, an app's home page with navigation,
+a feature list, inline SVG, scripts and a long footer; saved pages can be added
+with --file.
+
+    python -m benchmarks.client_parsing --iterations 20 [--file page.html ...]
+"""
+
+import argparse
+from dataclasses import asdict
+from pathlib import Path
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+import httpx
+import indieweb_utils
+
+from indieauthify_server.common.client import parse_client_document
+
+CLIENT_ID = 'https://app.example.com/'
+
+Parsed = Tuple[Optional[Dict[str, str]], FrozenSet[str]]
+
+
+def paragraphs(feature: int) -> str:
+    """
+    A feature section's paragraphs of linked, marked up text
+    """
+
+    return ''.join(
+        f'<p>Paragraph {line} about feature {feature}, with <a href="/features/{feature}#{line}">a link</a> '
+        f'and <em>some</em> <strong>markup</strong>.</p>'
+        for line in range(12)
+    )
+
+
+def generate_page(sections: int) -> str:
+    """
+    A client home page with this many feature sections, around 4KiB each
+    """
+
+    nav = ''.join(f'<li><a href="/docs/{index}">Documentation {index}</a></li>' for index in range(40))
+    svg = '<svg viewBox="0 0 24 24">' + ''.join(f'<path d="M{index} 0L{index} 24"/>' for index in range(24)) + '</svg>'
+    points = ''.join(f'<li class="item">Point {point}</li>' for point in range(10))
+    features = ''.join(
+        f'<section class="feature" id="feature-{index}"><h2>Feature {index}</h2>{svg}{paragraphs(index)}<ul>{points}</ul></section>'
+        for index in range(sections)
+    )
+    footer = ''.join(f'<a href="https://elsewhere.example/{index}" rel="nofollow">Partner {index}</a> ' for index in range(200))
+
+    return f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Example App</title>
+<link rel="stylesheet" href="/static/app.css">
+<link rel="redirect_uri" href="/callback">
+<link rel="redirect_uri other" href="https://app.example.com/mobile/callback">
+<link rel="icon" href="/favicon.ico">
+<script>window.config = {{"features": [{", ".join(str(index) for index in range(500))}]}};</script>
+</head>
+<body>
+<header><nav><ul>{nav}</ul></nav></header>
+<main>
+<div class="h-app">
+<img class="u-logo" src="https://app.example.com/logo.png" alt="">
+<a class="u-url p-name" href="https://app.example.com/">Example App</a>
+<p class="p-summary">An app for posting to your website</p>
+</div>
+{features}
+</main>
+<footer>{footer}</footer>
+<script src="/static/app.js"></script>
+</body>
+</html>
+'''
+
+
+def response(page: str) -> httpx.Response:
+    """
+    A client_id page response, with a redirect URI in its Link header too
+    """
+
+    return httpx.Response(
+        200,
+        headers={'content-type': 'text/html; charset=utf-8', 'link': '</link/callback>; rel="redirect_uri"'},
+        text=page,
+        request=httpx.Request('GET', CLIENT_ID)
+    )
+
+
+def parse_twice(page: httpx.Response) -> Parsed:
+    """
+    The previous parser; one BeautifulSoup parse for the links and another by indieweb_utils for the h-app
+    """
+
+    base_url = str(page.url)
+    redirect_uris = {urljoin(base_url, link['url']) for link in page.links.values() if 'redirect_uri' in link.get('rel', '').split()}
+    for link in BeautifulSoup(page.text, 'lxml').find_all('link'):
+        if 'redirect_uri' in link.get('rel', []) and link.get('href'):
+            redirect_uris.add(urljoin(base_url, link.get('href')))
+
+    try:
+        h_app_item = asdict(indieweb_utils.get_h_app_item(page.text))
+    except indieweb_utils.indieauth.happ.HAppNotFound:
+        h_app_item = None
+
+    return h_app_item, frozenset(redirect_uris)
+
+
+def mean_time(parse: Callable[[httpx.Response], Parsed], page: httpx.Response, iterations: int) -> float:
+    """
+    Mean time to parse a page, in milliseconds
+    """
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse(page)
+
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+
+    parser = argparse.ArgumentParser(description='Compare client_id page parsers')
+    parser.add_argument('--iterations', type=int, default=20, help='parses of each page per parser')
+    parser.add_argument('--file', type=Path, action='append', default=[], help='a saved client_id page to add to the generated ones')
+    args = parser.parse_args()
+
+    pages: List[Tuple[str, str]] = [(f'generated {sections} sections', generate_page(sections)) for sections in (4, 32, 128)]
+    pages.extend((path.name, path.read_text(encoding='utf-8')) for path in args.file)
+
+    for label, text in pages:
+        page = response(text)
+        expected, actual = parse_twice(page), parse_client_document(page)
+        if expected != actual:
+            print(f'{label}: results differ\n  previous {expected}\n  single pass {actual}')
+
+        before = mean_time(parse_twice, page, args.iterations)
+        after = mean_time(parse_client_document, page, args.iterations)
+        print(
+            f'{label:28} {len(text) / 1024:7.1f}KiB  previous {before:8.2f}ms  '
+            f'single pass {after:8.2f}ms  {before / after:5.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+"""
+IndieAuthify: benchmarks; HTTP endpoint load test
+
+Boots the server with uvicorn, in this process, against a temporary token
+database and a local stub HTTP server standing in for the me URL, its rel=me
+links and a client_id page, then drives each endpoint in turn at the given
+concurrency, reporting latency percentiles and throughput. The GitHub login isn't
+driven; its URLs point at the stub, which 404s them, so that nothing reaches
+GitHub. The results are saved as JSON, named after the current commit, so that
+runs on different commits can be compared.
+
+    python -m benchmarks.endpoints --concurrency 16 --requests 2000
+    python -m benchmarks.endpoints --compare benchmarks/results/<commit>.json
+"""
+
+import argparse
+import asyncio
+from dataclasses import asdict, dataclass
+import datetime
+import http.server
+import itertools
+import json
+import os
+from pathlib import Path
+import platform
+import secrets
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import indieweb_utils
+import itsdangerous
+import jwt
+import uvicorn
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+SESSION_KEY = 'benchmark-session-key'
+API_KEY = 'benchmark-api-key'
+
+ME_PAGE = """<html><body>
+<div class="h-card"><a class="p-name u-url" href="{base}/">Benchmark</a></div>
+<a rel="me" href="{base}/profile/1">one</a>
+<a rel="me" href="{base}/profile/2">two</a>
+</body></html>"""
+PROFILE_PAGE = '<html><body><a rel="me" href="{base}">home</a></body></html>'
+CLIENT_PAGE = """<html><head><link rel="redirect_uri" href="{base}/app/callback"></head>
+<body><div class="h-app"><img class="u-logo" src="{base}/app/logo.png"><a class="p-name u-url" href="{base}/app/">App</a></div></body></html>"""
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the me page, its rel=me profiles and a client_id page
+    """
+
+    pages: Dict[str, str] = {}
+
+    def do_GET(self) -> None:    # pylint: disable=invalid-name
+        """
+        Serve a page, or 404
+        """
+
+        body = self.pages.get(self.path.split('?')[0])
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        encoded = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format: str, *args: Any) -> None:    # pylint: disable=redefined-builtin
+        """
+        Don't log requests
+        """
+
+
+def start_stub() -> Tuple[http.server.ThreadingHTTPServer, str]:
+    """
+    Start the stub server on a free port, returning it and its base URL
+    """
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    base = f'http://127.0.0.1:{server.server_port}'
+    StubHandler.pages = {
+        '/': ME_PAGE.format(base=base),
+        '/profile/1': PROFILE_PAGE.format(base=base),
+        '/profile/2': PROFILE_PAGE.format(base=base),
+        '/app/': CLIENT_PAGE.format(base=base),
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base
+
+
+def configure(stub: str, db_path: Path) -> None:
+    """
+    Point the server's settings at the stub and the temporary database; this has to
+    happen before anything reads the settings
+    """
+
+    os.environ.update({
+        'APP_ENV': 'production',
+        'ME': f'{stub}/',
+        'GITHUB_CLIENT_ID': 'benchmark',
+        'GITHUB_CLIENT_SECRET': 'benchmark',
+        'GITHUB_BASE_URL': f'{stub}/github/',
+        'GITHUB_TOKEN_URL': f'{stub}/github/login/oauth/access_token',
+        'GITHUB_AUTHORIZE_URL': f'{stub}/github/login/oauth/authorize',
+        'SESSION_KEY': SESSION_KEY,
+        'API_KEY': API_KEY,
+        'RPC_TIMEOUT': '5',
+        'TOKEN_DB_PATH': str(db_path),
+        'WEBHOOK_SERVER': 'false',
+        'TRACING_EXPORTER': 'none',
+    })
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+
+def start_server() -> Tuple[uvicorn.Server, threading.Thread, str]:
+    """
+    Start the server with uvicorn in a background thread, returning its base URL once it's up
+    """
+
+    from indieauthify_server.server import app    # pylint: disable=import-outside-toplevel
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # accepted connections inherit this; without it, responses written in more than one
+    # send stall for the client's delayed ACK
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level='warning', lifespan='on'))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError('server failed to start')
+        time.sleep(0.01)
+
+    return server, thread, f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+async def sign_in(me: str) -> str:    # pylint: disable=invalid-name
+    """
+    Create a signed in session, returning its session cookie; the GitHub callback
+    can't be stubbed, as it verifies the rel=me link to github.com
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from indieauthify_server.common.tokens import token_digest
+    from indieauthify_server.dependencies.sessions import get_session_backend
+
+    session_id, version = secrets.token_urlsafe(32), secrets.token_urlsafe(6)
+    data = json.dumps({'logged_in': True, 'me': me, 'rel_me_check': me})
+    await get_session_backend().save(token_digest(session_id), data, int(time.time()) + 86400, version)
+    return itsdangerous.TimestampSigner(SESSION_KEY).sign(f'{session_id}.{version}').decode('utf-8')
+
+
+def access_token(me: str, client_id: str) -> str:    # pylint: disable=invalid-name
+    """
+    An access token as issued by POST /token
+    """
+
+    claims = {
+        'me': me,
+        'client_id': client_id,
+        'scope': 'create update',
+        'resource': 'all',
+        'expires': int(time.time()) + 86400,
+    }
+    return jwt.encode(claims, SESSION_KEY, algorithm='HS256')
+
+
+def authorization_code(me: str, client_id: str, redirect_uri: str) -> str:    # pylint: disable=invalid-name
+    """
+    An authorization code as issued by POST /generate
+    """
+
+    return indieweb_utils.generate_auth_token(
+        me, client_id, redirect_uri, 'code', secrets.token_urlsafe(16), None, 'create', SESSION_KEY
+    ).code
+
+
+Request = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+def scenarios(me: str, stub: str) -> Dict[str, Tuple[Request, int]]:    # pylint: disable=invalid-name
+    """
+    The benchmarked requests, by name, with their expected status codes; each is
+    called with the client and the request number
+    """
+
+    client_id = f'{stub}/app/'
+    redirect_uri = f'{stub}/app/callback'
+    tokens = [access_token(me, f'{stub}/app/{i}') for i in range(256)]
+    codes = itertools.cycle([authorization_code(me, client_id, redirect_uri) for _ in range(256)])
+
+    authorize = {
+        'me': me,
+        'code': '',
+        'client_id': client_id,
+        'redirect_uri': redirect_uri,
+        'response_type': 'code',
+        'state': 'benchmark',
+        'scope': 'create',
+    }
+    generate = {
+        'me': me,
+        'client_id': client_id,
+        'redirect_uri': redirect_uri,
+        'response_type': 'code',
+        'scope': 'create',
+        'is_manually_issued': 'false',
+    }
+
+    def redeem(_: int) -> Dict[str, str]:
+        return {
+            'action': '',
+            'grant_type': 'authorization_code',
+            'code': next(codes),
+            'client_id': client_id,
+            'redirect_uri': redirect_uri,
+            'code_verifier': '',
+        }
+
+    return {
+        'GET /metadata': (lambda client, _: client.get('/metadata'), 200),
+        'GET /auth': (lambda client, _: client.request('GET', '/auth', json=authorize), 200),
+        'POST /generate': (lambda client, _: client.post('/generate', data=generate), 307),
+        'GET /token': (
+            lambda client, i: client.get('/token', headers={'Authorization': f'Bearer {tokens[i % len(tokens)]}'}),
+            200
+        ),
+        'POST /token': (lambda client, i: client.post('/token', json=redeem(i)), 200),
+        'GET /issued': (lambda client, _: client.get('/issued', params={'authorization': API_KEY}), 200),
+    }
+
+
+@dataclass
+class Result:
+    """
+    Latency percentiles, in milliseconds, and throughput, in requests per second
+    """
+
+    requests: int
+    errors: int
+    throughput: float
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+
+
+async def drive(client: httpx.AsyncClient, request: Request, expected: int, count: int, concurrency: int) -> Result:
+    """
+    Make count requests, concurrency at a time
+    """
+
+    counter = itertools.count()
+    timings: List[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+
+        while (number := next(counter)) < count:
+            start = time.perf_counter()
+            try:
+                response = await request(client, number)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+
+            timings.append(time.perf_counter() - start)
+            if response.status_code != expected:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    cuts = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+    return Result(
+        requests=count,
+        errors=errors,
+        throughput=count / elapsed,
+        mean=statistics.fmean(timings) * 1000 if timings else 0.0,
+        p50=cuts[49] * 1000,
+        p95=cuts[94] * 1000,
+        p99=cuts[98] * 1000,
+    )
+
+
+async def run(base: str, stub: str, count: int, concurrency: int, warmup: int) -> Dict[str, Result]:
+    """
+    Drive every scenario in turn
+    """
+
+    me = f'{stub}/'    # pylint: disable=invalid-name
+    results = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=30.0) as client:
+        client.cookies.set('session', await sign_in(me))
+        for name, (request, expected) in scenarios(me, stub).items():
+            await drive(client, request, expected, warmup, concurrency)
+            results[name] = result = await drive(client, request, expected, count, concurrency)
+            print(
+                f'{name:16} {result.throughput:9.1f} req/s  mean {result.mean:7.2f}ms  '
+                f'p50 {result.p50:7.2f}ms  p95 {result.p95:7.2f}ms  p99 {result.p99:7.2f}ms  '
+                f'errors {result.errors}'
+            )
+
+    return results
+
+
+def commit() -> str:
+    """
+    The current commit's short hash, marked if the tree has uncommitted changes
+    """
+
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, check=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return f'{sha}-dirty' if dirty.strip() else sha
+
+
+def compare(results: Dict[str, Result], baseline_path: Path, count: int, concurrency: int) -> None:
+    """
+    Print the change in throughput and latency against an earlier run
+    """
+
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+    print(f'\ncompared with {baseline["commit"]} ({baseline["date"]})')
+    if (baseline['requests'], baseline['concurrency']) != (count, concurrency):
+        print(
+            f'warning: that run made {baseline["requests"]} requests per endpoint, '
+            f'{baseline["concurrency"]} concurrent, so the results aren\'t directly comparable'
+        )
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+
+        changes = '  '.join(
+            f'{key} {(getattr(result, key) - before[key]) / before[key] * 100:+6.1f}%'
+            for key in ('throughput', 'p50', 'p95', 'p99') if before[key]
+        )
+        print(f'{name:16} {changes}')
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    """
+    Run the load test
+    """
+
+    parser = argparse.ArgumentParser(description='Load test the IndieAuthify endpoints')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight at once')
+    parser.add_argument('--warmup', type=int, default=100, help='untimed requests per endpoint first')
+    parser.add_argument('--output', type=Path, help=f'where to save the results; defaults to {RESULTS_DIR}/<commit>.json')
+    parser.add_argument('--compare', type=Path, help='an earlier run\'s results to compare against')
+    parsed = parser.parse_args(args)
+
+    stub, stub_base = start_stub()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(stub_base, Path(tmp) / 'tokens.db')
+        server, thread, base = start_server()
+        try:
+            print(f'{parsed.requests} requests per endpoint, {parsed.concurrency} concurrent')
+            results = asyncio.run(run(base, stub_base, parsed.requests, parsed.concurrency, parsed.warmup))
+        finally:
+            server.should_exit = True
+            thread.join()
+            stub.shutdown()
+
+    revision = commit()
+    output = parsed.output or RESULTS_DIR / f'{revision}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        'commit': revision,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'requests': parsed.requests,
+        'concurrency': parsed.concurrency,
+        'results': {name: asdict(result) for name, result in results.items()},
+    }, indent=2), encoding='utf-8')
+    print(f'\nsaved results to {output}')
+
+    if parsed.compare:
+        compare(results, parsed.compare, parsed.requests, parsed.concurrency)
+
+
+if __name__ == '__main__':
+    main()
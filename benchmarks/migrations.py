@@ -0,0 +1,125 @@
+"""
+IndieAuthify: benchmarks; token database lookup benchmark
+
+Times the token database's lookups against the baseline schema, with no
+primary keys or indexes, and again after migrating to the current schema.
+
+    python -m benchmarks.migrations --rows 100000
+"""
+
+import argparse
+from pathlib import Path
+import random
+import secrets
+import sqlite3
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from indieauthify_server.common.tokens import token_digest
+from indieauthify_server.migrations import SCHEMA_VERSION, migrate
+
+# (baseline query, current query); the current schema keys tokens by their digest
+LOOKUPS: Dict[str, Tuple[str, str]] = {
+    'issued by token': (
+        'SELECT * FROM issued_tokens WHERE token = ?',
+        'SELECT * FROM issued_tokens WHERE token_hash = ?',
+    ),
+    'issued by client_id': (
+        'SELECT * FROM issued_tokens WHERE client_id = ?',
+        'SELECT * FROM issued_tokens WHERE client_id = ?',
+    ),
+    'revoked by token': (
+        'SELECT * FROM revoked_tokens WHERE token = ?',
+        'SELECT * FROM revoked_tokens WHERE token_hash = ?',
+    ),
+}
+
+
+def populate(connection: sqlite3.Connection, rows: int) -> List[tuple]:
+    """
+    Fill the baseline tables, returning the issued rows
+    """
+
+    now = int(time.time())
+    issued: List[tuple] = [
+        (
+            secrets.token_urlsafe(96),
+            'https://example.com',
+            '2023-01-01 00:00:00',
+            f'https://client-{i}.example.com/',
+            now + random.randint(-86400, 86400),
+            '{}',
+        ) for i in range(rows)
+    ]
+    connection.executemany('INSERT INTO issued_tokens VALUES (?, ?, ?, ?, ?, ?)', issued)
+    connection.executemany('INSERT INTO revoked_tokens VALUES (?)', ((row[0],) for row in issued))
+    connection.commit()
+    return issued
+
+
+def timed(func: Callable[[], object], iterations: int) -> float:
+    """
+    Mean time per call, in microseconds
+    """
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench(connection: sqlite3.Connection, issued: List[tuple], iterations: int, migrated: bool) -> Dict[str, float]:
+    """
+    Time each lookup against randomly chosen rows
+    """
+
+    samples = random.sample(issued, iterations)
+    results = {}
+    for label, queries in LOOKUPS.items():
+        query = queries[migrated]
+        if 'client_id' in label:
+            values = iter([sample[3] for sample in samples])
+        elif migrated:
+            values = iter([token_digest(sample[0]) for sample in samples])
+        else:
+            values = iter([sample[0] for sample in samples])
+
+        def lookup(query: str = query, values: Iterator[object] = values) -> object:
+            return connection.execute(query, (next(values),)).fetchall()
+
+        results[label] = timed(lookup, iterations)
+
+    return results
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+
+    parser = argparse.ArgumentParser(description='Token database lookup benchmark')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        connection = sqlite3.connect(Path(tmpdir) / 'token-store.db')
+        migrate(connection, target=1)
+        issued = populate(connection, args.rows)
+        before = bench(connection, issued, args.iterations, migrated=False)
+
+        start = time.perf_counter()
+        migrate(connection)
+        print(f'migration to schema version {SCHEMA_VERSION} took {time.perf_counter() - start:.2f}s')
+        after = bench(connection, issued, args.iterations, migrated=True)
+        connection.close()
+
+    print(f'{"lookup, " + str(args.rows) + " rows":28} {"baseline":>12} {"migrated":>12}')
+    for label in LOOKUPS:
+        print(f'{label:28} {before[label]:10.1f}us {after[label]:10.1f}us')
+
+
+if __name__ == '__main__':
+    main()
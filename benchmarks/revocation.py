@@ -0,0 +1,102 @@
+"""
+IndieAuthify: benchmarks; token revocation check benchmark
+
+Measures the latency of checking a token that hasn't been revoked, the common
+case on every GET /token, against a revoked_tokens table holding a large number
+of revocations; first with a plain SELECT against the table, as token_handler
+used to do, then through the token store's revocation filter.
+
+    python -m benchmarks.revocation --revoked 1000000 --iterations 2000
+"""
+
+import argparse
+import asyncio
+from pathlib import Path
+import secrets
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import List
+
+from indieauthify_server.common.tokens import token_digest
+from indieauthify_server.dependencies.tokenstore import TokenStore
+
+# the revoked_tokens table as it was before the schema migrations added indexes
+LEGACY_SCHEMA = 'CREATE TABLE revoked_tokens (token text)'
+
+
+def report(label: str, timings: List[float]) -> None:
+    """
+    Print latency percentiles, in microseconds
+    """
+
+    timings = sorted(timings)
+    p50 = statistics.median(timings) * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    print(f'{label:32} p50 {p50:10.1f}us  p99 {p99:10.1f}us')
+
+
+def bench_select(path: Path, tokens: List[str]) -> List[float]:
+    """
+    Plain SELECT against revoked_tokens per check
+    """
+
+    timings = []
+    with sqlite3.connect(path) as connection:
+        for token in tokens:
+            start = time.perf_counter()
+            connection.execute('SELECT * FROM revoked_tokens WHERE token = ?', (token,)).fetchone()
+            timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+async def bench_store(store: TokenStore, tokens: List[str]) -> List[float]:
+    """
+    Revocation filter backed token store check
+    """
+
+    timings = []
+    for token in tokens:
+        start = time.perf_counter()
+        await store.is_revoked(token_digest(token))
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+
+    parser = argparse.ArgumentParser(description='Token revocation check benchmark')
+    parser.add_argument('--revoked', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--select-iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / 'token-store.db'
+        with sqlite3.connect(path) as connection:
+            connection.execute(LEGACY_SCHEMA)
+            connection.executemany(
+                'INSERT INTO revoked_tokens (token) VALUES (?)',
+                ((secrets.token_urlsafe(96),) for _ in range(args.revoked))
+            )
+
+        tokens = [secrets.token_urlsafe(96) for _ in range(args.iterations)]
+
+        report(f'SELECT, {args.revoked} revoked', bench_select(path, tokens[:args.select_iterations]))
+
+        store = TokenStore(path, revocation_capacity=args.revoked)
+        start = time.perf_counter()
+        store.open()
+        print(f'revocation filter load: {time.perf_counter() - start:.2f}s')
+        report(f'token store, {args.revoked} revoked', asyncio.run(bench_store(store, tokens)))
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
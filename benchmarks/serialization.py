@@ -0,0 +1,79 @@
+"""
+IndieAuthify: benchmarks; JSON response serialisation benchmark
+
+Compares rendering the token introspection and metadata payloads with
+Starlette's stdlib json based JSONResponse against the orjson based
+response class the server now uses.
+
+    python -m benchmarks.serialization --iterations 100000
+"""
+
+import argparse
+import time
+from typing import Any, Callable, Dict
+
+from fastapi.responses import JSONResponse as StdlibJSONResponse
+import indieweb_utils
+
+from indieauthify_server.common.responses import JSONResponse
+
+PAYLOADS: Dict[str, Any] = {
+    'token': {
+        'me': 'https://example.com/',
+        'client_id': 'https://app.example.com/',
+        'scope': 'create update delete media profile',
+        'profile': {
+            'name': 'Example',
+            'photo': 'https://example.com/photo.jpg',
+            'url': 'https://example.com/',
+            'email': 'me@example.com'
+        }
+    },
+    'metadata': {
+        'issuer': 'https://auth.example.com/auth',
+        'authorization_endpoint': 'https://auth.example.com/auth',
+        'token_endpoint': 'https://auth.example.com/generate',
+        'revocation_endpoint': 'https://auth.example.com/revoke_token',
+        'scopes_supported': indieweb_utils.SCOPE_DEFINITIONS,
+        'response_types_supported': ['code'],
+        'response_models_supported': ['query'],
+        'grant_types_supported': ['authorization_code'],
+        'service_documentation': 'https://indieauth.spec.indieweb.org/',
+        'code_challenge_methods_supported': ['S256']
+    },
+}
+
+
+def throughput(render: Callable[[Any], bytes], payload: Any, iterations: int) -> float:
+    """
+    Renders per second
+    """
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render(payload)
+
+    return iterations / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+
+    parser = argparse.ArgumentParser(description='JSON response serialisation benchmark')
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    stdlib = StdlibJSONResponse(content=None)
+    orjson = JSONResponse(content=None)
+
+    print(f'{"payload":10} {"json/sec":>12} {"orjson/sec":>12} {"speedup":>8}')
+    for label, payload in PAYLOADS.items():
+        before = throughput(stdlib.render, payload, args.iterations)
+        after = throughput(orjson.render, payload, args.iterations)
+        print(f'{label:10} {before:12.0f} {after:12.0f} {after / before:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
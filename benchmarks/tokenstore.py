@@ -0,0 +1,79 @@
+"""
+IndieAuthify: benchmarks; token store connection micro-benchmark
+
+Compares opening a fresh sqlite3 connection per request, as the handlers used
+to do, against borrowing a connection from the pooled token store.
+
+    python -m benchmarks.tokenstore --iterations 5000
+"""
+
+import argparse
+from pathlib import Path
+import sqlite3
+import tempfile
+import time
+
+from indieauthify_server.common.tokens import token_digest
+from indieauthify_server.dependencies.tokenstore import TokenStore
+from indieauthify_server.migrations import migrate
+
+QUERY = 'SELECT * FROM revoked_tokens WHERE token_hash = ?'
+MISSING = token_digest('missing')
+
+
+def bench_connect(path: Path, iterations: int) -> float:
+    """
+    Per-request sqlite3.connect; returns connections/sec
+    """
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute(QUERY, (MISSING,)).fetchone()
+        connection.close()
+
+    return iterations / (time.perf_counter() - start)
+
+
+def bench_pool(path: Path, iterations: int) -> float:
+    """
+    Pooled token store connections; returns connections/sec
+    """
+
+    store = TokenStore(path)
+    store.open()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with store.connection() as connection:
+            connection.execute(QUERY, (MISSING,)).fetchone()
+
+    elapsed = time.perf_counter() - start
+    store.close()
+    return iterations / elapsed
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+
+    parser = argparse.ArgumentParser(description='Token store connection benchmark')
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / 'token-store.db'
+        with sqlite3.connect(path) as connection:
+            migrate(connection)
+
+        before = bench_connect(path, args.iterations)
+        after = bench_pool(path, args.iterations)
+
+    print(f'sqlite3.connect per request: {before:10.0f} connections/sec')
+    print(f'pooled token store:          {after:10.0f} connections/sec')
+    print(f'speedup:                     {after / before:10.1f}x')
+
+
+if __name__ == '__main__':
+    main()
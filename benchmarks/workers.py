@@ -0,0 +1,140 @@
+"""
+IndieAuthify: benchmarks; gunicorn worker boot time and memory benchmark
+
+Starts gunicorn with gunicorn.conf.py, against a temporary token database and
+the endpoint benchmark's stub server, with and without preload_app, and reports
+how long the workers took to boot and how much memory they use once they have.
+PSS, proportional set size, splits shared pages between the processes sharing
+them, so the total PSS is the memory the server really uses; USS is the memory
+private to each worker. Linux only, as it reads /proc.
+
+    python -m benchmarks.workers --workers 4
+"""
+
+import argparse
+import os
+from pathlib import Path
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, IO, List, Tuple
+
+from benchmarks.endpoints import configure, start_stub
+
+APP_ROOT = Path(__file__).parents[1]
+
+BOOTING = re.compile(r'Booting worker with pid: (\d+)')
+STARTED = re.compile(r'\[(\d+)\] \[INFO\] Application startup complete')
+
+
+def memory(pid: int) -> Dict[str, int]:
+    """
+    A process's resident, proportional and unique set sizes, in KiB
+    """
+
+    fields = {}
+    for line in Path(f'/proc/{pid}/smaps_rollup').read_text(encoding='utf-8').splitlines()[1:]:
+        key, value = line.split(':', 1)
+        fields[key] = int(value.split()[0])
+
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def boot(tmp: Path, workers: int, preload: bool, timeout: float) -> Tuple[float, List[float], int, Dict[int, Dict[str, int]]]:
+    """
+    Start gunicorn and wait for every worker to finish starting up; returns the time
+    until they had, each worker's boot time and the memory use of the master and of
+    each worker
+    """
+
+    env = dict(os.environ, GUNICORN_PRELOAD=str(preload).lower(), PROMETHEUS_MULTIPROC_DIR=str(tmp / 'metrics'))
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--config', str(APP_ROOT / 'gunicorn.conf.py'),
+        '--bind', f'unix:{tmp / "api.sock"}',
+        '--pid', str(tmp / 'api.pid'),
+        '--workers', str(workers),
+        'indieauthify_server.server:app',
+    ]
+
+    booting: Dict[int, float] = {}
+    started: Dict[int, float] = {}
+    all_started = threading.Event()
+
+    def read_log(stderr: IO[str]) -> None:
+        for line in stderr:
+            now = time.perf_counter()
+            if match := BOOTING.search(line):
+                booting[int(match.group(1))] = now
+            elif match := STARTED.search(line):
+                started[int(match.group(1))] = now
+                if len(started) == workers:
+                    all_started.set()
+
+    start = time.perf_counter()
+    with subprocess.Popen(command, cwd=APP_ROOT, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True) as process:
+        reader = threading.Thread(target=read_log, args=(process.stderr,), daemon=True)
+        reader.start()
+        try:
+            if not all_started.wait(timeout):
+                raise RuntimeError(f'only {len(started)} of {workers} workers started within {timeout}s')
+
+            elapsed = max(started.values()) - start
+            boot_times = [now - booting[pid] for pid, now in started.items() if pid in booting]
+            usage = {pid: memory(pid) for pid in started}
+            return elapsed, boot_times, process.pid, {process.pid: memory(process.pid), **usage}
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout)
+            # the log reaches EOF once gunicorn exits; finish reading it before it's closed
+            reader.join(timeout)
+
+
+def report(label: str, workers: int, preload: bool, tmp: Path, timeout: float) -> None:
+    """
+    Boot gunicorn and print its boot times and memory use
+    """
+
+    elapsed, boot_times, master, usage = boot(tmp, workers, preload, timeout)
+    worker_usage = [value for pid, value in usage.items() if pid != master]
+    total_pss = sum(value['pss'] for value in usage.values())
+    mean = lambda key: sum(value[key] for value in worker_usage) / len(worker_usage) / 1024    # noqa: E731 pylint: disable=unnecessary-lambda-assignment
+
+    print(
+        f'{label:12} all ready {elapsed:6.2f}s  worker boot mean {sum(boot_times) / len(boot_times):5.2f}s '
+        f'max {max(boot_times):5.2f}s  worker RSS {mean("rss"):6.1f}MiB  PSS {mean("pss"):6.1f}MiB  '
+        f'USS {mean("uss"):6.1f}MiB  total PSS {total_pss / 1024:6.1f}MiB'
+    )
+
+
+def main() -> None:
+    """
+    Run the benchmark
+    """
+
+    parser = argparse.ArgumentParser(description='Measure gunicorn worker boot time and memory use')
+    parser.add_argument('--workers', type=int, default=4, help='number of workers')
+    parser.add_argument('--timeout', type=float, default=60.0, help='how long to wait for the workers to start')
+    args = parser.parse_args()
+
+    stub, stub_base = start_stub()
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(stub_base, Path(tmp) / 'tokens.db')
+        os.environ['TEMPLATE_CACHE_DIR'] = str(Path(tmp) / 'templates')
+        try:
+            for label, preload in (('no preload', False), ('preload', True)):
+                report(label, args.workers, preload, Path(tmp), args.timeout)
+        finally:
+            stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,5 @@
 #!/bin/bash
 
-if [[ ! -r "${TOKEN_DB_PATH}" ]]; then
-    echo "Bootstrapping ${TOKEN_DB_PATH}"
-    sqlite3 -batch "${TOKEN_DB_PATH}" < /service/init-tokendb.sql
-else
-    echo "${TOKEN_DB_PATH} found; skipping bootstrap"
-fi
+echo "Migrating ${TOKEN_DB_PATH}"
+python3 -m indieauthify_server.migrations || exit 1
 exec "$@"
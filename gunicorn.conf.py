@@ -3,9 +3,18 @@
 Reference Data API gunicorn configuration settings
 """
 
+import gc
 import multiprocessing
+import os
+from pathlib import Path
+import shutil
+
 import setproctitle    # pylint: disable=unused-import # noqa: F401
 
+# Prometheus metrics are written per worker process to this directory and aggregated by /metrics;
+# it has to be set before any worker imports prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/dev/shm/indieauthify-metrics')
+
 # Server Mechanics: https://docs.gunicorn.org/en/latest/settings.html#server-mechanics
 daemon = False
 pidfile = 'run/api.pid'
@@ -20,6 +29,11 @@ workers = multiprocessing.cpu_count() * 2 + 1
 max_requests = 10000
 worker_class = 'uvicorn.workers.UvicornWorker'
 
+# Import the app, settings and templates once in the master rather than in every worker;
+# workers then share those pages copy-on-write. Code changes then need a full restart
+# rather than a HUP, so preloading can be turned off with GUNICORN_PRELOAD=false
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
 # Logging: https://docs.gunicorn.org/en/stable/settings.html#logging
 accesslog = '-'
 errorlog = '-'
@@ -27,3 +41,49 @@ loglevel = 'info'
 
 # Process naming: https://docs.gunicorn.org/en/stable/settings.html#process-naming
 proc_name = 'indieauthify-server'
+
+
+# Server Hooks: https://docs.gunicorn.org/en/stable/settings.html#server-hooks
+def on_starting(server):    # pylint: disable=unused-argument
+    """
+    Start each run with an empty metrics directory
+    """
+
+    metrics_dir = Path(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir(parents=True)
+
+
+def when_ready(server):
+    """
+    Import the modules the app otherwise imports on first use, then move everything the
+    preloaded app allocated into the permanent generation, so that the workers' garbage
+    collections don't touch, and so copy, the shared pages
+    """
+
+    if server.cfg.preload_app:
+        from indieauthify_server.server import import_deferred    # pylint: disable=import-outside-toplevel
+
+        import_deferred()
+        gc.freeze()
+
+
+def post_fork(server, worker):    # pylint: disable=unused-argument
+    """
+    Have each worker of a preloaded app create its own connections, clients and tasks
+    """
+
+    if server.cfg.preload_app:
+        from indieauthify_server.server import post_fork as reset_worker    # pylint: disable=import-outside-toplevel
+
+        reset_worker()
+
+
+def child_exit(server, worker):    # pylint: disable=unused-argument
+    """
+    Drop an exited worker's live gauges from the aggregated metrics
+    """
+
+    from prometheus_client import multiprocess    # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,81 @@
+"""
+IndieAuthify: common package; Bloom filter module
+"""
+
+import math
+from typing import Iterator, List
+
+
+class _BloomSlice:    # pylint: disable=too-few-public-methods
+    """
+    A single fixed capacity Bloom filter
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.count = 0
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2)**2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def positions(self, digest: bytes) -> Iterator[int]:
+        """
+        Bit positions for a digest, by double hashing the digest's first 16 bytes
+        """
+
+        hash1 = int.from_bytes(digest[:8], 'little')
+        hash2 = int.from_bytes(digest[8:16], 'little') | 1
+        for index in range(self.num_hashes):
+            yield (hash1 + index * hash2) % self.num_bits
+
+
+class BloomFilter:
+    """
+    A scalable Bloom filter of uniformly distributed digests, such as SHA-256 hashes
+
+    When the current slice reaches its capacity a new slice of twice the capacity,
+    and half the error rate, is added so the overall false positive rate stays
+    bounded as the filter grows.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001) -> None:
+        self.error_rate = error_rate
+        self._slices: List[_BloomSlice] = [_BloomSlice(capacity, error_rate / 2)]
+
+    def add(self, digest: bytes) -> None:
+        """
+        Add a digest to the filter
+        """
+
+        current = self._slices[-1]
+        if current.count >= current.capacity:
+            current = _BloomSlice(current.capacity * 2, self.error_rate / 2**(len(self._slices) + 1))
+            self._slices.append(current)
+
+        bits = current.bits
+        for position in current.positions(digest):
+            bits[position >> 3] |= 1 << (position & 7)
+
+        current.count += 1
+
+    def __contains__(self, digest: object) -> bool:
+        if not isinstance(digest, bytes):
+            return False
+
+        for bloom_slice in self._slices:
+            bits = bloom_slice.bits
+            if all(bits[position >> 3] & (1 << (position & 7)) for position in bloom_slice.positions(digest)):
+                return True
+
+        return False
+
+    def __len__(self) -> int:
+        return sum(bloom_slice.count for bloom_slice in self._slices)
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the filter's bit arrays, in bytes
+        """
+
+        return sum(len(bloom_slice.bits) for bloom_slice in self._slices)
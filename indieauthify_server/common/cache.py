@@ -0,0 +1,83 @@
+"""
+IndieAuthify: common package; in-memory cache utilities module
+"""
+
+from collections import OrderedDict
+import time
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A bounded, least recently used cache with optional per-entry expiry
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[K, Tuple[Optional[float], V]] = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        """
+        Get an unexpired entry, marking it as most recently used
+        """
+
+        try:
+            expires, value = self._data[key]
+        except KeyError:
+            return None
+
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key: K) -> Optional[V]:
+        """
+        Get an entry, expired or not, without touching the LRU order
+        """
+
+        try:
+            return self._data[key][1]
+        except KeyError:
+            return None
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        """
+        Add or replace an entry, evicting the least recently used entry if the cache is full;
+        ttl overrides the cache's default time to live, in seconds
+        """
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        """
+        Remove an entry, returning it if it was present
+        """
+
+        entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def clear(self) -> None:
+        """
+        Remove every entry
+        """
+
+        self._data.clear()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,253 @@
+"""
+IndieAuthify: common package; client_id metadata discovery and cache module
+"""
+
+import asyncio
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from http import HTTPStatus
+import logging
+import time
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import httpx
+
+from indieauthify_server.common.cache import LRUCache
+from indieauthify_server.common.metrics import FETCH_DURATION, record_cache
+from indieauthify_server.dependencies.http import get_http_client
+from indieauthify_server.dependencies.settings import get_settings
+
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443
+}
+
+# The h-app properties shown on the authorization page and stored with issued tokens
+H_APP_PROPERTIES = ('name', 'logo', 'url', 'summary')
+
+
+class InvalidClientId(ValueError):
+    """
+    A client_id, or me, URL which isn't a fetchable http or https URL
+    """
+
+
+@dataclass(frozen=True)
+class ClientMetadata:
+    """
+    The parsed, cacheable metadata from a client_id page
+    """
+
+    client_id: str
+    status_code: int
+    h_app_item: Optional[Dict[str, str]] = None
+    redirect_uris: FrozenSet[str] = field(default_factory=frozenset)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    expires: float = 0.0
+
+
+def normalise_client_id(client_id: str) -> str:
+    """
+    Normalise a client_id URL for use as a cache key; lower case scheme and host,
+    no default port, no fragment and an explicit root path. Raises InvalidClientId
+    if it isn't an http or https URL with a host and a valid port
+    """
+
+    try:
+        parts = urlsplit(client_id.strip())
+        port = parts.port
+    except ValueError as exc:
+        raise InvalidClientId(f'invalid URL {client_id!r}: {exc}') from exc
+
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        raise InvalidClientId(f'invalid URL {client_id!r}: not an http or https URL with a host')
+
+    netloc = parts.hostname.lower()
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f'{netloc}:{port}'
+
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def parse_cache_control(headers: httpx.Headers) -> Tuple[bool, Optional[int]]:
+    """
+    Parse a response's Cache-Control header into whether it can be stored and its max-age, if any
+    """
+
+    directives = {}
+    for directive in headers.get('cache-control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+
+    if 'no-store' in directives:
+        return False, None
+
+    if 'no-cache' in directives:
+        return True, 0
+
+    for name in ('s-maxage', 'max-age'):
+        try:
+            return True, max(int(directives[name]), 0)
+        except (KeyError, ValueError):
+            continue
+
+    return True, None
+
+
+def find_h_app_item(items: List[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """
+    The first top level h-app item in a page's parsed microformats, with the first
+    value of each of its properties, or an empty string if it doesn't have one
+    """
+
+    for item in items:
+        if item.get('type', [None])[0] == 'h-app':
+            properties = item['properties']
+            return {name: properties[name][0] if properties.get(name) else '' for name in H_APP_PROPERTIES}
+
+    return None
+
+
+def parse_client_document(response: httpx.Response) -> Tuple[Optional[Dict[str, str]], FrozenSet[str]]:
+    """
+    Parse a client_id page into its h-app item and its absolute rel=redirect_uri URLs,
+    from both the Link headers and the HTML; the HTML is parsed once, into a single
+    tree shared by the link and microformats parsing
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from bs4 import BeautifulSoup
+    import mf2py
+
+    base_url = str(response.url)
+    redirect_uris = {
+        urljoin(base_url,
+                link['url'])
+        for link in response.links.values()
+        if 'redirect_uri' in link.get('rel', '').split()
+    }
+
+    if response.status_code != HTTPStatus.OK:
+        return None, frozenset(redirect_uris)
+
+    soup = BeautifulSoup(response.text, 'lxml')
+    for link in soup.find_all('link', rel='redirect_uri', href=True):
+        redirect_uris.add(urljoin(base_url, link['href']))
+
+    # mf2py walks the tree it's given rather than parsing the page again
+    items = mf2py.parse(doc=soup, url=base_url)['items']
+
+    return find_h_app_item(items), frozenset(redirect_uris)
+
+
+class ClientMetadataCache:    # pylint: disable=too-few-public-methods
+    """
+    A bounded LRU cache of client_id metadata which honours the client's Cache-Control
+    and revalidates stale entries with If-None-Match/If-Modified-Since
+    """
+
+    def __init__(self, maxsize: int, ttl: int, max_ttl: int) -> None:
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+
+        self._cache: LRUCache[str, ClientMetadata] = LRUCache(maxsize)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get(self, client_id: str) -> ClientMetadata:
+        """
+        Get the metadata for a client_id, fetching or revalidating it if the cached entry is missing or stale
+        """
+
+        key = normalise_client_id(client_id)
+        cached = self._cache.get(key)
+
+        if cached is not None and cached.expires > time.monotonic():
+            record_cache('client', 'hit')
+            return cached
+
+        # coalesce concurrent fetches for the same client_id
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            metadata = await self._fetch(key, cached)
+            future.set_result(metadata)
+            return metadata
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # the exception is re-raised to this caller; don't warn if no-one else awaited it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _fetch(self, key: str, stale: Optional[ClientMetadata]) -> ClientMetadata:
+        """
+        Fetch, or conditionally revalidate, a client_id page
+        """
+
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers['If-None-Match'] = stale.etag
+            if stale.last_modified:
+                headers['If-Modified-Since'] = stale.last_modified
+
+        try:
+            with FETCH_DURATION.labels('client_id').time():
+                response = await get_http_client().get(key, headers=headers)
+        except httpx.InvalidURL as exc:
+            raise InvalidClientId(f'invalid URL {key!r}: {exc}') from exc
+
+        storable, max_age = parse_cache_control(response.headers)
+        ttl = min(self.ttl if max_age is None else max_age, self.max_ttl)
+        expires = time.monotonic() + ttl
+
+        if stale is not None and response.status_code == HTTPStatus.NOT_MODIFIED:
+            record_cache('client', 'revalidated')
+            metadata = replace(stale, expires=expires)
+            self._cache.set(key, metadata)
+            return metadata
+
+        record_cache('client', 'miss')
+        h_app_item, redirect_uris = await asyncio.to_thread(parse_client_document, response)
+        metadata = ClientMetadata(
+            client_id=key,
+            status_code=response.status_code,
+            h_app_item=h_app_item,
+            redirect_uris=redirect_uris,
+            etag=response.headers.get('etag'),
+            last_modified=response.headers.get('last-modified'),
+            expires=expires
+        )
+
+        if storable and response.status_code == HTTPStatus.OK:
+            self._cache.set(key, metadata)
+        else:
+            logging.debug('not caching client metadata for %s (%d)', key, response.status_code)
+            self._cache.pop(key)
+
+        return metadata
+
+
+@lru_cache
+def get_client_metadata_cache() -> ClientMetadataCache:
+    """
+    Get this worker's client_id metadata cache
+    """
+
+    settings = get_settings()
+    return ClientMetadataCache(
+        maxsize=settings.client_cache_size,
+        ttl=settings.client_cache_ttl,
+        max_ttl=settings.client_cache_max_ttl
+    )
@@ -0,0 +1,134 @@
+"""
+IndieAuthify: common package; Prometheus metrics module
+
+Under gunicorn each worker is a separate process, so the metrics are written to
+per-process files in PROMETHEUS_MULTIPROC_DIR, which gunicorn.conf.py sets up,
+and /metrics aggregates them across every worker.
+"""
+
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# SQLite lookups are tens of microseconds, outbound fetches up to rpc_timeout seconds
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# webhook notifications are delivered within a poll interval, or hours later after backoff
+WEBHOOK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0, 14400.0, 86400.0)
+
+REQUEST_DURATION = Histogram(
+    'indieauthify_request_duration_seconds',
+    'HTTP request latency',
+    ['method', 'route']
+)
+RESPONSES = Counter(
+    'indieauthify_responses_total',
+    'HTTP responses by status code',
+    ['method', 'route', 'status']
+)
+ERRORS = Counter(
+    'indieauthify_errors_total',
+    'JSON error responses by OAuth error code',
+    ['error']
+)
+DB_DURATION = Histogram(
+    'indieauthify_db_query_duration_seconds',
+    'Token database query latency, including waiting for a connection',
+    ['operation'],
+    buckets=DB_BUCKETS
+)
+FETCH_DURATION = Histogram(
+    'indieauthify_fetch_duration_seconds',
+    'Outbound HTTP fetch latency',
+    ['call_site'],
+    buckets=FETCH_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    'indieauthify_cache_requests_total',
+    'Cache lookups by result; hit ratio is hit / sum over results',
+    ['cache', 'result']
+)
+WEBHOOK_ATTEMPTS = Counter(
+    'indieauthify_webhook_attempts_total',
+    'Webhook notification delivery attempts by result',
+    ['result']
+)
+WEBHOOK_DEAD_LETTERS = Counter(
+    'indieauthify_webhook_dead_letters_total',
+    'Webhook notifications moved to the dead letter table after max_attempts'
+)
+WEBHOOK_LATENCY = Histogram(
+    'indieauthify_webhook_delivery_latency_seconds',
+    'Time from queueing a webhook notification to delivering it, including retries',
+    buckets=WEBHOOK_BUCKETS
+)
+
+
+def record_cache(cache: str, result: str) -> None:
+    """
+    Count a cache lookup
+    """
+
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+def render_metrics() -> Response:
+    """
+    Render the metrics, aggregated across every worker process if there is more than one
+    """
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    # CONTENT_TYPE_LATEST already carries the charset, so it's set as a header rather than the media type
+    return Response(content=generate_latest(registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+class MetricsMiddleware:    # pylint: disable=too-few-public-methods
+    """
+    Records the latency and status code of every HTTP request, labelled by route template
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the router adds the matched route to the scope; label by its path template
+            # rather than the request path, so that query strings and IDs don't explode
+            # the label cardinality
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            REQUEST_DURATION.labels(scope['method'], path).observe(time.perf_counter() - start)
+            RESPONSES.labels(scope['method'], path, str(status)).inc()
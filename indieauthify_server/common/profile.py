@@ -0,0 +1,181 @@
+"""
+IndieAuthify: common package; me profile cache module
+"""
+
+import asyncio
+from dataclasses import asdict, dataclass, replace
+from functools import lru_cache
+from http import HTTPStatus
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from indieauthify_server.common.cache import LRUCache
+from indieauthify_server.common.client import InvalidClientId, normalise_client_id, parse_cache_control
+from indieauthify_server.common.metrics import FETCH_DURATION, record_cache
+from indieauthify_server.dependencies.http import get_http_client
+from indieauthify_server.dependencies.settings import get_settings
+
+
+@dataclass(frozen=True)
+class CachedProfile:
+    """
+    The h-card profile of a me URL, ready to be returned from token introspection
+    """
+
+    me: str    # pylint: disable=invalid-name
+    profile: Dict[str, Any]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    expires: float = 0.0
+    fetched_at: float = 0.0
+
+
+def parse_profile(me: str, html: str) -> Dict[str, Any]:    # pylint: disable=invalid-name
+    """
+    Parse the h-card profile out of a me page
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from bs4 import BeautifulSoup
+    import indieweb_utils
+
+    # get_profile fetches the page itself when given empty HTML, so always hand it a soup
+    return asdict(indieweb_utils.get_profile(me, soup=BeautifulSoup(html, 'lxml')))
+
+
+class ProfileCache:    # pylint: disable=too-few-public-methods
+    """
+    A bounded LRU cache of me profiles which honours the page's Cache-Control and
+    revalidates stale entries with If-None-Match/If-Modified-Since
+
+    Once an entry is stale it's still served, and revalidated in the background,
+    until it's more than max_stale seconds past its expiry; only then does a
+    reader wait for the page to be fetched.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, max_ttl: int, max_stale: int) -> None:    # pylint: disable=too-many-arguments
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self.max_stale = max_stale
+
+        self._cache: LRUCache[str, CachedProfile] = LRUCache(maxsize)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def get(self, me: str) -> Optional[Dict[str, Any]]:    # pylint: disable=invalid-name
+        """
+        Get the profile for a me URL, or None if it can't be fetched
+        """
+
+        try:
+            key = normalise_client_id(me)
+        except InvalidClientId as exc:
+            logging.warning('profile fetch for %s failed: %s', me, exc)
+            return None
+
+        cached = self._cache.get(key)
+        now = time.monotonic()
+
+        if cached is not None and cached.expires > now:
+            record_cache('profile', 'hit')
+            return cached.profile
+
+        if cached is not None and cached.expires + self.max_stale > now:
+            record_cache('profile', 'stale')
+            self._refresh(key, cached)
+            return cached.profile
+
+        try:
+            return (await asyncio.shield(self._refresh(key, cached))).profile
+        except (ValueError, httpx.HTTPError) as exc:
+            logging.warning('profile fetch for %s failed: %s', key, exc)
+            return None
+
+    def _refresh(self, key: str, stale: Optional[CachedProfile]) -> asyncio.Task:
+        """
+        Start fetching, or revalidating, a me page, unless that's already under way
+        """
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, stale))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            # background revalidations are never awaited; log rather than lose their failures
+            task.add_done_callback(self._log_failure)
+            self._inflight[key] = task
+
+        return task
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        """
+        Log a failed fetch
+        """
+
+        if not task.cancelled() and task.exception() is not None:
+            logging.debug('profile refresh failed: %s', task.exception())
+
+    async def _fetch(self, key: str, stale: Optional[CachedProfile]) -> CachedProfile:
+        """
+        Fetch, or conditionally revalidate, a me page
+        """
+
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers['If-None-Match'] = stale.etag
+            if stale.last_modified:
+                headers['If-Modified-Since'] = stale.last_modified
+
+        try:
+            with FETCH_DURATION.labels('profile').time():
+                response = await get_http_client().get(key, headers=headers)
+        except httpx.InvalidURL as exc:
+            raise InvalidClientId(f'invalid URL {key!r}: {exc}') from exc
+
+        storable, max_age = parse_cache_control(response.headers)
+        ttl = min(self.ttl if max_age is None else max_age, self.max_ttl)
+        now = time.monotonic()
+
+        if stale is not None and response.status_code == HTTPStatus.NOT_MODIFIED:
+            record_cache('profile', 'revalidated')
+            cached = replace(stale, expires=now + ttl, fetched_at=now)
+            self._cache.set(key, cached)
+            return cached
+
+        if response.status_code != HTTPStatus.OK:
+            raise ValueError(f'{key} returned {response.status_code}')
+
+        record_cache('profile', 'miss')
+        cached = CachedProfile(
+            me=key,
+            profile=await asyncio.to_thread(parse_profile, key, response.text),
+            etag=response.headers.get('etag'),
+            last_modified=response.headers.get('last-modified'),
+            expires=now + ttl,
+            fetched_at=now
+        )
+
+        if storable:
+            self._cache.set(key, cached)
+        else:
+            self._cache.pop(key)
+
+        return cached
+
+
+@lru_cache
+def get_profile_cache() -> ProfileCache:
+    """
+    Get this worker's me profile cache
+    """
+
+    settings = get_settings()
+    return ProfileCache(
+        maxsize=settings.profile_cache_size,
+        ttl=settings.profile_cache_ttl,
+        max_ttl=settings.profile_cache_max_ttl,
+        max_stale=settings.profile_max_stale
+    )
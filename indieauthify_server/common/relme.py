@@ -2,57 +2,273 @@
 IndieAuthify: common package; rel=me utilities module
 """
 
+import asyncio
+from functools import lru_cache
 from http import HTTPStatus
-from typing import List
+import logging
+import time
+from typing import List, Optional
 import urllib.parse
 
-from bs4 import BeautifulSoup
-from indieweb_utils.parsing.parse import get_parsed_mf2_data
-from indieweb_utils.utils.urls import canonicalize_url
+import httpx
 from pydantic import HttpUrl
-import requests
+from indieauthify_server.common.metrics import FETCH_DURATION, record_cache
+from indieauthify_server.common.tracing import span
 from indieauthify_server.common.url import normalise_url
 
+from indieauthify_server.dependencies.http import get_http_client
 from indieauthify_server.dependencies.settings import get_settings
 
 
-def get_relme_links(url: HttpUrl, require_link_back: bool = True) -> List[str]:
+def links_back_to(html: str, canonical_url: str) -> bool:
+    """
+    Does a page have a rel=me link pointing back to the canonical URL?
+    """
+
+    from bs4 import BeautifulSoup    # pylint: disable=import-outside-toplevel
+
+    parsed_page = BeautifulSoup(html, 'html.parser')
+    page_links = parsed_page.find_all('a') + parsed_page.find_all('link')
+
+    for item in page_links:
+        if 'me' not in item.get('rel', []):
+            continue
+
+        if item.get('href') == canonical_url:
+            return True
+
+    return False
+
+
+async def verify_relme_link(
+    http_client: httpx.AsyncClient,
+    link: str,
+    canonical_url: str,
+    semaphore: asyncio.Semaphore
+) -> Optional[str]:
+    """
+    Fetch a rel=me link and return its canonical form if it links back to the canonical URL
+    """
+
+    from indieweb_utils.utils.urls import canonicalize_url    # pylint: disable=import-outside-toplevel
+
+    with span('relme.verify_link', link=link) as link_span:
+        async with semaphore:
+            try:
+                with FETCH_DURATION.labels('relme_link').time():
+                    resp = await http_client.get(link)
+            except httpx.HTTPError as exc:
+                link_span.set_attribute('error', f'{type(exc).__name__}: {exc}')
+                return None
+
+        link_span.set_attribute('http.status_code', resp.status_code)
+        if resp.status_code != HTTPStatus.OK:
+            return None
+
+        if not await asyncio.to_thread(links_back_to, resp.text, canonical_url):
+            link_span.set_attribute('links_back', False)
+            return None
+
+        link_span.set_attribute('links_back', True)
+
+    link_domain = urllib.parse.urlparse(link).netloc
+    return canonicalize_url(link, link_domain)
+
+
+async def get_relme_links(
+    url: HttpUrl,
+    require_link_back: bool = True,
+    concurrency: int | None = None,
+    deadline: float | None = None,
+    strict: bool = False
+) -> List[str]:
     """
     Get the valid links on a page that link back to a rel=me URL
+
+    The rel=me links are verified concurrently, at most concurrency at a time;
+    links that haven't been verified when the deadline passes are dropped and
+    the links verified so far are returned. A page that can't be fetched has no
+    links, unless strict, when the fetch error is raised instead.
     """
 
+    # pylint: disable=import-outside-toplevel
+    from indieweb_utils.utils.urls import canonicalize_url
+    import mf2py
+
+    settings = get_settings()
+    concurrency = concurrency or settings.relme_concurrency
+    deadline = deadline or settings.relme_deadline
+
     domain = urllib.parse.urlparse(url).netloc
     canonical_url = normalise_url(canonicalize_url(url, domain), noslash=True, noscheme=False)
-    mf2_data = get_parsed_mf2_data(parsed_mf2=None, html=None, url=canonical_url)
-    relme_links = [canonicalize_url(url, domain) for url in mf2_data['rels'].get('me', [])]
-    valid_links = set()
+    http_client = get_http_client()
+    with span('relme.get_links', url=canonical_url, require_link_back=require_link_back) as relme_span:
+        with span('relme.fetch_page', url=canonical_url):
+            try:
+                with FETCH_DURATION.labels('relme_page').time():
+                    resp = await http_client.get(canonical_url)
+                    if strict:
+                        resp.raise_for_status()
+            except httpx.HTTPError:
+                if strict:
+                    raise
+                return []
 
-    if not require_link_back:
-        return list(set(relme_links))
+        with span('relme.parse_page'):
+            mf2_data = await asyncio.to_thread(mf2py.parse, doc=resp.text, url=str(resp.url))
+            relme_links = list({canonicalize_url(url, domain) for url in mf2_data['rels'].get('me', [])})
+
+        relme_span.set_attribute('links', len(relme_links))
+        if not require_link_back or not relme_links:
+            return relme_links
+
+        with span('relme.verify_links', concurrency=concurrency, deadline=deadline) as verify_span:
+            semaphore = asyncio.Semaphore(concurrency)
+            tasks = [
+                asyncio.create_task(verify_relme_link(http_client, link, canonical_url, semaphore))
+                for link in relme_links
+            ]
+            done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+            for task in pending:
+                task.cancel()
+
+            verify_span.set_attribute('unverified', len(pending))
+
+        if pending:
+            logging.warning(
+                'rel=me verification for %s timed out after %ss; %d of %d links unverified',
+                canonical_url,
+                deadline,
+                len(pending),
+                len(tasks)
+            )
+
+        valid = list({result for task in done if task.exception() is None and (result := task.result()) is not None})
+        relme_span.set_attribute('valid_links', len(valid))
+        return valid
+
+
+class RelMeCache:
+    """
+    A background refreshed cache of the valid rel=me links on a single, fixed page
+
+    Readers get the last known links; once they're older than the refresh
+    interval a refresh is started in the background (stale-while-revalidate) and
+    a scheduled task keeps them fresh in the steady state. If refreshing keeps
+    failing the links are served until they're more than max_stale seconds past
+    the refresh interval, then dropped. Only a cold cache makes a reader wait for
+    the links to be fetched.
+    """
+
+    def __init__(self, url: HttpUrl, refresh_interval: float, max_stale: float) -> None:
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.max_stale = max_stale
+        self.links: Optional[List[str]] = None
+        self.refreshed_at = 0.0
+
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._schedule_task: Optional[asyncio.Task] = None
+
+    def _expire(self) -> None:
+        """
+        Drop the links once they're more than max_stale seconds past the refresh interval
+        """
+
+        if self.links is not None and time.monotonic() - self.refreshed_at > self.refresh_interval + self.max_stale:
+            logging.warning('rel=me links for %s are past their max staleness; dropping them', self.url)
+            self.links = None
+
+    async def _refresh(self) -> None:
+        """
+        Fetch and verify the rel=me links, keeping the previous links if the page can't be fetched
+        """
 
-    settings = get_settings()
-    for link in relme_links:
         try:
-            resp = requests.get(link, timeout=settings.rpc_timeout)
-        except requests.exceptions.RequestException:
-            continue
+            links = await get_relme_links(self.url, require_link_back=True, strict=True)
+        except Exception as exc:    # pylint: disable=broad-exception-caught
+            logging.error('rel=me refresh for %s failed: %s', self.url, exc)
+            self._expire()
+            return
 
-        if resp.status_code != HTTPStatus.OK:
-            continue
+        logging.debug('rel=me refresh for %s found %s', self.url, links)
+        self.links = links
+        self.refreshed_at = time.monotonic()
 
-        parsed_page = BeautifulSoup(resp.text, 'html.parser')
-        page_links = parsed_page.find_all('a') + parsed_page.find_all('link')
-        link_domain = urllib.parse.urlparse(link).netloc
+    def refresh(self) -> asyncio.Task:
+        """
+        Start a background refresh, unless one is already running
+        """
 
-        for item in page_links:
-            if not item.get('rel') and require_link_back:
-                continue
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
 
-            if 'me' not in item.get('rel', '') and require_link_back:
-                continue
+        return self._refresh_task
 
-            if item.get('href') == canonical_url:
-                canonical_link = canonicalize_url(link, link_domain)
-                valid_links.add(canonical_link)
+    async def get(self) -> List[str]:
+        """
+        Get the cached rel=me links
+        """
 
-    return list(valid_links)
+        self._expire()
+        links = self.links
+        if links is None:
+            record_cache('relme', 'miss')
+            await asyncio.shield(self.refresh())
+            return self.links or []
+
+        if time.monotonic() - self.refreshed_at > self.refresh_interval:
+            record_cache('relme', 'stale')
+            self.refresh()
+        else:
+            record_cache('relme', 'hit')
+
+        return links
+
+    async def _schedule(self) -> None:
+        """
+        Refresh the links every refresh interval
+        """
+
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        """
+        Start warming and periodically refreshing the cache
+        """
+
+        if self._schedule_task is None:
+            self._schedule_task = asyncio.create_task(self._schedule())
+
+    async def stop(self) -> None:
+        """
+        Stop refreshing the cache
+        """
+
+        for task in (self._schedule_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        self._schedule_task = None
+        self._refresh_task = None
+
+
+@lru_cache
+def get_relme_cache() -> RelMeCache:
+    """
+    Get this worker's cache of the configured me page's rel=me links
+    """
+
+    settings = get_settings()
+    return RelMeCache(
+        settings.me,
+        refresh_interval=settings.relme_refresh_interval,
+        max_stale=settings.relme_max_stale
+    )
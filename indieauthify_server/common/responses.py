@@ -0,0 +1,57 @@
+"""
+IndieAuthify: common package; response classes module
+"""
+
+from typing import Any
+
+from fastapi.responses import ORJSONResponse
+import orjson
+
+from indieauthify_server.common.metrics import ERRORS
+
+# The error codes counted by name in the errors metric; anything else is counted as
+# other, so that the metric's labels stay bounded whatever ends up in an error
+OAUTH_ERRORS = frozenset({
+    'access_denied',
+    'invalid_client',
+    'invalid_code',
+    'invalid_grant',
+    'invalid_request',
+    'invalid_scope',
+    'invalid_ticket',
+    'invalid_token',
+    'insufficient_scope',
+    'server_error',
+    'temporarily_unavailable',
+    'unauthorized_client',
+    'unsupported_grant_type',
+    'unsupported_response_type',
+    'unsupported_token_type',
+})
+
+
+def json_default(value: Any) -> Any:
+    """
+    Serialise the values orjson doesn't handle natively; exceptions become their message
+    """
+
+    if isinstance(value, BaseException):
+        return str(value)
+
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+
+    raise TypeError(f'{type(value).__name__} is not JSON serialisable')
+
+
+class JSONResponse(ORJSONResponse):
+    """
+    orjson encoded JSON response, which also serialises exceptions in error details
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, dict) and 'error' in content:
+            error = content['error']
+            ERRORS.labels(error if isinstance(error, str) and error in OAUTH_ERRORS else 'other').inc()
+
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
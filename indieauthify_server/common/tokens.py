@@ -0,0 +1,83 @@
+"""
+IndieAuthify: common package; token utilities module
+"""
+
+from functools import lru_cache
+import hashlib
+import secrets
+from typing import Any, Dict, Optional
+
+from indieauthify_server.common.cache import LRUCache
+from indieauthify_server.dependencies.settings import get_settings
+
+BEARER_PREFIX = 'Bearer '
+
+
+def strip_bearer(authorization: str) -> str:
+    """
+    Strip the Bearer scheme from an Authorization header, leaving the token
+    """
+
+    authorization = authorization.strip()
+    if authorization[:len(BEARER_PREFIX)].lower() == BEARER_PREFIX.lower():
+        return authorization[len(BEARER_PREFIX):].strip()
+
+    return authorization
+
+
+def has_api_key(authorization: str) -> bool:
+    """
+    Does an Authorization header carry the server's API key as its Bearer token?
+    """
+
+    api_key = get_settings().api_key
+    return bool(api_key) and secrets.compare_digest(strip_bearer(authorization).encode('utf-8'), api_key.encode('utf-8'))
+
+
+def token_digest(token: str) -> bytes:
+    """
+    Fixed width SHA-256 digest of a token
+    """
+
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+def parse_token_id(value: str) -> bytes:
+    """
+    Parse a token identifier, as used in the issued and revoke page links, into a
+    token digest; either the hex encoded digest or the token itself
+    """
+
+    if len(value) == hashlib.sha256().digest_size * 2:
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            pass
+
+    return token_digest(value)
+
+
+def token_expiry(token: str, key: str) -> Optional[int]:
+    """
+    The expiry time of a token issued by this server, if it's valid and has one
+    """
+
+    import jwt    # pylint: disable=import-outside-toplevel
+
+    try:
+        claims = jwt.decode(token, key, algorithms=['HS256'], options={'verify_exp': False})
+    except jwt.InvalidTokenError:
+        return None
+
+    expires = claims.get('expires')
+    return int(expires) if isinstance(expires, (int, float)) else None
+
+
+@lru_cache
+def get_claims_cache() -> LRUCache[bytes, Dict[str, Any]]:
+    """
+    Get this worker's cache of verified token claims, keyed by token digest; entries
+    expire with their token and are removed when their token is revoked
+    """
+
+    return LRUCache(get_settings().claims_cache_size)
@@ -0,0 +1,290 @@
+"""
+IndieAuthify: common package; request tracing module
+
+Spans follow the OpenTelemetry model; 128-bit trace IDs and 64-bit span IDs,
+parent/child nesting through a context variable, which asyncio tasks and
+asyncio.to_thread inherit, and W3C traceparent propagation from incoming
+requests. Finished spans go to the configured exporter:
+
+    none    spans are not recorded, the default
+    file    one JSON object per span, per line, appended to TRACING_FILE
+    otel    spans are handed to the OpenTelemetry SDK, which must be installed
+            and configured separately, e.g. with opentelemetry-instrument; the
+            spans take their trace and span IDs from OpenTelemetry's, so log
+            lines can be matched to the exported traces
+
+Log records carry the current trace and span IDs, and TraceFormatter appends
+them to every log line written inside a span.
+"""
+
+import contextlib
+import contextvars
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+import json
+import logging
+from pathlib import Path
+import queue
+import re
+import secrets
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from indieauthify_server.dependencies.settings import get_settings
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+
+@dataclass
+class Span:    # pylint: disable=too-many-instance-attributes
+    """
+    A single timed operation within a trace
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    end: Optional[float] = None
+    status: str = 'ok'
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """
+        Add or replace an attribute
+        """
+
+        self.attributes[key] = value
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+class FileExporter:
+    """
+    Appends finished spans to a JSON lines file from a background thread, so that
+    tracing never blocks the event loop on disk I/O
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._write, name='tracing-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, finished: Span) -> None:
+        """
+        Queue a finished span to be written
+        """
+
+        self._queue.put(finished)
+
+    def _write(self) -> None:
+        """
+        Write queued spans until the exporter is shut down
+        """
+
+        with open(self.path, 'a', encoding='utf-8') as traces:
+            while (finished := self._queue.get()) is not None:
+                traces.write(json.dumps(asdict(finished), default=str) + '\n')
+                if self._queue.empty():
+                    traces.flush()
+
+    def shutdown(self) -> None:
+        """
+        Write any queued spans and stop the writer thread
+        """
+
+        self._queue.put(None)
+        self._thread.join()
+
+
+class Tracer:
+    """
+    Creates spans and hands them to an exporter when they finish; with no exporter
+    spans are still created, so that log lines carry trace IDs, but not recorded
+    """
+
+    def __init__(self, exporter: Optional[FileExporter] = None, otel_tracer: Any = None, otel_propagator: Any = None) -> None:
+        self.exporter = exporter
+        self.otel_tracer = otel_tracer
+        self.otel_propagator = otel_propagator
+
+    @contextlib.contextmanager
+    def span(self, name: str, traceparent: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+        """
+        Time the enclosed block as a child of the current span, or of the remote parent
+        in a W3C traceparent header, or as the root of a new trace
+        """
+
+        parent = _current_span.get()
+        remote = TRACEPARENT.match(traceparent or '') if parent is None else None
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        elif remote is not None:
+            trace_id, parent_id = remote.group(1), remote.group(2)
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+        span_id = secrets.token_hex(8)
+
+        with self._otel_span(name, traceparent if remote is not None else None) as otel_span:
+            # an OpenTelemetry span, if it's recording, has the IDs the exported trace will have
+            context = otel_span.get_span_context() if otel_span is not None else None
+            if context is not None and context.is_valid:
+                trace_id, span_id = f'{context.trace_id:032x}', f'{context.span_id:016x}'
+                otel_parent = getattr(otel_span, 'parent', None)
+                parent_id = f'{otel_parent.span_id:016x}' if otel_parent is not None else None
+
+            record = Span(name, trace_id, span_id, parent_id, attributes=dict(attributes))
+            token = _current_span.set(record)
+            try:
+                yield record
+            except BaseException as exc:
+                record.status = 'error'
+                record.set_attribute('exception', f'{type(exc).__name__}: {exc}')
+                raise
+            finally:
+                record.end = time.time()
+                _current_span.reset(token)
+                if otel_span is not None:
+                    otel_span.set_attributes({key: str(value) for key, value in record.attributes.items()})
+                if self.exporter is not None:
+                    self.exporter.export(record)
+
+    def _otel_span(self, name: str, traceparent: Optional[str]) -> contextlib.AbstractContextManager:
+        """
+        Start the OpenTelemetry span mirroring a span, if it's configured; as a child of
+        the current OpenTelemetry span or, for a request's root span, of the remote parent
+        """
+
+        if self.otel_tracer is None:
+            return contextlib.nullcontext()
+
+        context = None
+        if traceparent is not None:
+            context = self.otel_propagator.extract({'traceparent': traceparent})
+
+        return self.otel_tracer.start_as_current_span(name, context=context)
+
+    def shutdown(self) -> None:
+        """
+        Flush and stop the exporter
+        """
+
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+@lru_cache
+def get_tracer() -> Tracer:
+    """
+    Get this worker's tracer, with the configured exporter
+    """
+
+    settings = get_settings()
+    if settings.tracing_exporter == 'none':
+        return Tracer()
+
+    if settings.tracing_exporter == 'file':
+        return Tracer(exporter=FileExporter(settings.tracing_file))
+
+    if settings.tracing_exporter == 'otel':
+        # pylint: disable=import-outside-toplevel,import-error
+        from opentelemetry import trace
+        from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+        return Tracer(otel_tracer=trace.get_tracer('indieauthify'), otel_propagator=TraceContextTextMapPropagator())
+
+    raise ValueError(f'unknown tracing exporter {settings.tracing_exporter}')
+
+
+def span(name: str, **attributes: Any) -> contextlib.AbstractContextManager[Span]:
+    """
+    Time the enclosed block as a span of the current trace
+    """
+
+    return get_tracer().span(name, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    """
+    Get the current span, if there is one
+    """
+
+    return _current_span.get()
+
+
+def install_log_record_factory() -> None:
+    """
+    Add the current trace and span IDs to every log record as trace_id and span_id
+    """
+
+    factory: Callable[..., logging.LogRecord] = logging.getLogRecordFactory()
+
+    def record_factory(*args: Any, **kwargs: Any) -> logging.LogRecord:
+        record = factory(*args, **kwargs)
+        span_ = _current_span.get()
+        record.trace_id = span_.trace_id if span_ is not None else None
+        record.span_id = span_.span_id if span_ is not None else None
+        return record
+
+    logging.setLogRecordFactory(record_factory)
+
+
+class TraceFormatter(logging.Formatter):
+    """
+    Wraps a handler's formatter to append the trace and span IDs to log lines written within a span
+    """
+
+    def __init__(self, formatter: Optional[logging.Formatter] = None) -> None:
+        super().__init__()
+        self.formatter = formatter or logging.Formatter()
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = self.formatter.format(record)
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id is None:
+            return line
+
+        return f'{line} trace_id={trace_id} span_id={getattr(record, "span_id", None)}'
+
+
+class TracingMiddleware:    # pylint: disable=too-few-public-methods
+    """
+    Wraps every HTTP request in a root span, continuing the caller's trace if the
+    request has a traceparent header
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope['headers']:
+            if name == b'traceparent':
+                traceparent = value.decode('latin-1')
+
+        with get_tracer().span(
+            f'{scope["method"]} {scope["path"]}',
+            traceparent=traceparent,
+            **{'http.method': scope['method'], 'http.target': scope['path']}
+        ) as request_span:
+
+            async def send_wrapper(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    request_span.set_attribute('http.status_code', message['status'])
+
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+            route = scope.get('route')
+            if route is not None:
+                request_span.set_attribute('http.route', route.path)
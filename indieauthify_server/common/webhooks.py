@@ -0,0 +1,185 @@
+"""
+IndieAuthify: common package; webhook delivery queue module
+"""
+
+import asyncio
+from functools import lru_cache
+from http import HTTPStatus
+import json
+import logging
+import random
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from indieauthify_server.common.metrics import FETCH_DURATION, WEBHOOK_ATTEMPTS, WEBHOOK_DEAD_LETTERS, WEBHOOK_LATENCY
+from indieauthify_server.dependencies.http import get_http_client
+from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.dependencies.tokenstore import TokenStore, get_token_store
+
+
+class WebhookQueue:
+    """
+    A durable, SQLite backed queue of webhook notifications, delivered in the background
+
+    Notifications are claimed in batches and delivered concurrently; failed deliveries
+    are retried with exponential backoff and jitter until max_attempts, after which they
+    are moved to the dead letter table. Claims are leased, so a notification claimed by
+    a worker which dies is picked up by another once its lease runs out.
+    """
+
+    def __init__(    # pylint: disable=too-many-arguments
+        self,
+        store: TokenStore,
+        batch_size: int,
+        max_attempts: int,
+        backoff: float,
+        max_backoff: float,
+        poll_interval: float
+    ) -> None:
+        self.store = store
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def enqueue(self, url: str, data: Dict[str, Any]) -> None:
+        """
+        Queue a form encoded notification for delivery to url
+        """
+
+        await self.store.enqueue_webhook(url, json.dumps(data), time.time())
+        self._wakeup.set()
+
+    def _next_attempt(self, attempts: int, now: float) -> float:
+        """
+        When to retry a notification that has failed attempts times, with jitter
+        """
+
+        delay = min(self.backoff * 2**attempts, self.max_backoff)
+        return now + random.uniform(delay / 2, delay)
+
+    async def _deliver(self, url: str, payload: str) -> Optional[str]:
+        """
+        Deliver one notification, returning why it failed, if it did; any failure,
+        even a bad URL, is returned so that the notification is retried or dead lettered
+        """
+
+        settings = get_settings()
+        headers = {
+            'Authorization': f'Bearer {settings.webhook_api_key}'
+        }
+
+        try:
+            with FETCH_DURATION.labels('webhook').time():
+                response = await get_http_client().post(url, data=json.loads(payload), headers=headers)
+        except httpx.HTTPError as exc:
+            return f'{type(exc).__name__}: {exc}'
+        except Exception as exc:    # pylint: disable=broad-except
+            logging.exception('webhook notification to %s raised', url)
+            return f'{type(exc).__name__}: {exc}'
+
+        if response.status_code >= HTTPStatus.BAD_REQUEST:
+            return f'HTTP {response.status_code}'
+
+        return None
+
+    async def deliver_batch(self) -> int:
+        """
+        Claim and deliver one batch of due notifications, returning the batch size
+        """
+
+        lease = get_settings().rpc_timeout * 2
+        batch = await self.store.claim_webhooks(time.time(), lease, self.batch_size)
+        if not batch:
+            return 0
+
+        errors = await asyncio.gather(*(self._deliver(url, payload) for _, url, payload, _, _ in batch))
+
+        now = time.time()
+        delivered: List[int] = []
+        retries: List[Tuple[int, float, str]] = []
+        dead: List[Tuple[int, float, str]] = []
+        for (id_, url, _, created, attempts), error in zip(batch, errors):
+            if error is None:
+                delivered.append(id_)
+                WEBHOOK_LATENCY.observe(now - created)
+            elif attempts + 1 >= self.max_attempts:
+                logging.error('webhook notification %d to %s failed %d times: %s', id_, url, attempts + 1, error)
+                dead.append((id_, now, error))
+            else:
+                logging.warning('webhook notification %d to %s failed: %s', id_, url, error)
+                retries.append((id_, self._next_attempt(attempts, now), error))
+
+        await self.store.settle_webhooks(delivered, retries, dead)
+        WEBHOOK_ATTEMPTS.labels('delivered').inc(len(delivered))
+        WEBHOOK_ATTEMPTS.labels('failed').inc(len(retries) + len(dead))
+        WEBHOOK_DEAD_LETTERS.inc(len(dead))
+        return len(batch)
+
+    async def _run(self) -> None:
+        """
+        Deliver notifications as they're queued, and poll for retries and notifications
+        queued by other workers
+        """
+
+        while True:
+            self._wakeup.clear()
+            try:
+                while await self.deliver_batch() == self.batch_size:
+                    pass
+            except sqlite3.Error as exc:
+                logging.error('webhook delivery failed: %s', exc)
+            except Exception:    # pylint: disable=broad-except
+                # keep delivering; the batch's claims lapse and it's retried
+                logging.exception('webhook delivery failed')
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """
+        Start delivering notifications in the background
+        """
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop delivering notifications; any still queued are delivered after a restart
+        """
+
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._task = None
+
+
+@lru_cache
+def get_webhook_queue() -> WebhookQueue:
+    """
+    Get this worker's webhook delivery queue
+    """
+
+    settings = get_settings()
+    return WebhookQueue(
+        get_token_store(),
+        batch_size=settings.webhook_batch_size,
+        max_attempts=settings.webhook_max_attempts,
+        backoff=settings.webhook_backoff,
+        max_backoff=settings.webhook_max_backoff,
+        poll_interval=settings.webhook_poll_interval
+    )
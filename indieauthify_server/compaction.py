@@ -0,0 +1,179 @@
+"""
+IndieAuthify: token database compaction module
+
+Expired issued tokens, tickets, revocations and sessions are deleted in bounded
+batches, free pages are returned to the file system and the query planner's
+statistics are refreshed, so that the database tracks the active tokens rather
+than every token ever issued. Every worker schedules this in the background,
+but each interval only the worker which takes the compaction lease, held in the
+database, runs it; it can also be run as a one-off, say from cron, with
+
+    python -m indieauthify_server.compaction [--vacuum]
+"""
+
+import argparse
+import asyncio
+from functools import lru_cache
+import logging
+import os
+import socket
+import sqlite3
+import time
+from typing import Dict, Optional
+
+from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.dependencies.tokenstore import EXPIRING_TABLES, TokenStore, get_token_store
+
+LEASE = 'compaction'
+
+
+async def compact(store: TokenStore, batch_size: int, vacuum_pages: int) -> Dict[str, int]:
+    """
+    Delete every expired row and reclaim the free pages, returning the number of
+    rows deleted per table and the number of pages freed
+    """
+
+    now = int(time.time())
+    reclaimed = {}
+    for table in EXPIRING_TABLES:
+        reclaimed[table] = await store.delete_expired(table, now, batch_size)
+
+    reclaimed['pages'] = await store.optimize(vacuum_pages)
+    return reclaimed
+
+
+class Compactor:
+    """
+    Periodically compacts the token database in the background; the compaction lease
+    lasts an interval, so that one process, of all those sharing the database, compacts it per interval
+    """
+
+    def __init__(self, store: TokenStore, interval: float, batch_size: int, vacuum_pages: int) -> None:
+        self.store = store
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.runs = 0
+        self.reclaimed: Dict[str, int] = {}
+
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> Dict[str, int]:
+        """
+        Compact the token database once
+        """
+
+        start = time.perf_counter()
+        reclaimed = await compact(self.store, self.batch_size, self.vacuum_pages)
+        self.runs += 1
+        for key, count in reclaimed.items():
+            self.reclaimed[key] = self.reclaimed.get(key, 0) + count
+
+        logging.info(
+            'token database compaction took %.2fs; reclaimed %s',
+            time.perf_counter() - start,
+            ', '.join(f'{count} {key}' for key, count in reclaimed.items())
+        )
+        return reclaimed
+
+    @staticmethod
+    def holder() -> str:
+        """
+        Identify this process as a lease holder; read each time, as a preloaded worker
+        may have been forked since the compactor was created
+        """
+
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    async def _schedule(self) -> None:
+        """
+        Compact the token database every interval
+        """
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await self.store.acquire_lease(LEASE, self.holder(), time.time(), self.interval):
+                    await self.run()
+                else:
+                    logging.debug('not compacting the token database; another process holds the lease')
+            except sqlite3.Error as exc:
+                logging.error('token database compaction failed: %s', exc)
+            except Exception:    # pylint: disable=broad-except
+                # keep compacting; the lease lapses and the next interval retries
+                logging.exception('token database compaction failed')
+
+    def start(self) -> None:
+        """
+        Start compacting periodically, unless compaction is disabled
+        """
+
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._schedule())
+
+    async def stop(self) -> None:
+        """
+        Stop compacting
+        """
+
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._task = None
+
+
+@lru_cache
+def get_compactor() -> Compactor:
+    """
+    Get this worker's token database compactor
+    """
+
+    settings = get_settings()
+    return Compactor(
+        get_token_store(),
+        interval=settings.token_gc_interval,
+        batch_size=settings.token_gc_batch_size,
+        vacuum_pages=settings.token_gc_vacuum_pages
+    )
+
+
+def main() -> None:
+    """
+    Compact the configured token database once
+    """
+
+    parser = argparse.ArgumentParser(description='Compact the IndieAuthify token database')
+    parser.add_argument(
+        '--vacuum',
+        action='store_true',
+        help='rebuild the database in incremental auto-vacuum mode; needs exclusive access'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    settings = get_settings()
+    store = get_token_store()
+    store.open()
+    try:
+        asyncio.run(Compactor(store, 0, settings.token_gc_batch_size, settings.token_gc_vacuum_pages).run())
+    finally:
+        store.close()
+
+    if args.vacuum:
+        # changing the auto-vacuum mode of an existing database needs a full VACUUM
+        connection = sqlite3.connect(settings.token_db_path, isolation_level=None)
+        try:
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+
+        logging.info('vacuumed %s', settings.token_db_path)
+
+
+if __name__ == '__main__':
+    main()
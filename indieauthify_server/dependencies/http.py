@@ -0,0 +1,157 @@
+"""
+IndieAuthify: dependencies package; shared HTTP client module
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional
+
+import httpx
+
+from indieauthify_server.dependencies.settings import get_settings
+
+USER_AGENT = 'IndieAuthify (+https://github.com/vicchi/indieauthify)'
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class _HostLimitedStream(httpx.AsyncByteStream):
+    """
+    Response stream that releases its host's connection slot once the body has been read
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]) -> None:
+        self._stream = stream
+        self._release: Optional[Callable[[], None]] = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:    # type: ignore[attr-defined]
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport that caps the number of concurrent requests to any single host,
+    on top of the pool-wide limits httpx already applies
+
+    Hosts come from client_id, me and rel=me URLs, so a host's semaphore is only
+    kept while requests to it are in flight or waiting, rather than for every host
+    ever fetched.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int) -> None:
+        self._transport = transport
+        self._max_per_host = max_per_host
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._users: Dict[str, int] = {}
+
+    def _leave(self, host: str) -> None:
+        """
+        A request to a host is done with it; forget the host once it has no requests in flight or waiting
+        """
+
+        self._users[host] -= 1
+        if self._users[host] == 0:
+            del self._semaphores[host]
+            del self._users[host]
+
+    def _release(self, host: str) -> None:
+        """
+        Release a host's connection slot
+        """
+
+        self._semaphores[host].release()
+        self._leave(host)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self._max_per_host))
+        self._users[host] = self._users.get(host, 0) + 1
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self._leave(host)
+            raise
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._release(host)
+            raise
+
+        response.stream = _HostLimitedStream(response.stream, lambda: self._release(host))    # type: ignore[arg-type]
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def open_http_client() -> httpx.AsyncClient:
+    """
+    Create this worker's shared, pooled HTTP client
+    """
+
+    global _client    # pylint: disable=global-statement
+
+    if _client is None:
+        settings = get_settings()
+        limits = httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry
+        )
+        transport = httpx.AsyncHTTPTransport(http2=settings.http2, limits=limits, retries=1)
+        logging.debug(
+            'opening HTTP client; http2: %s max connections: %d per host: %d',
+            settings.http2,
+            settings.http_max_connections,
+            settings.http_max_connections_per_host
+        )
+        _client = httpx.AsyncClient(
+            transport=HostLimitedTransport(transport, settings.http_max_connections_per_host),
+            timeout=settings.rpc_timeout,
+            follow_redirects=True,
+            headers={'User-Agent': USER_AGENT}
+        )
+
+    return _client
+
+
+async def close_http_client() -> None:
+    """
+    Close this worker's shared HTTP client
+    """
+
+    global _client    # pylint: disable=global-statement
+
+    if _client is not None:
+        logging.debug('closing HTTP client')
+        await _client.aclose()
+        _client = None
+
+
+def discard_http_client() -> None:
+    """
+    Forget a shared HTTP client inherited from a parent process, without closing
+    it; its connections and event loop belong to the parent
+    """
+
+    global _client    # pylint: disable=global-statement
+
+    _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get this worker's shared HTTP client
+    """
+
+    return open_http_client()
@@ -0,0 +1,249 @@
+"""
+IndieAuthify: dependencies package; server-side session store module
+
+A drop in replacement for Starlette's SessionMiddleware which keeps the session
+data on the server; the cookie carries only a signed, random session ID and the
+version of the session it was issued with. The session is serialised once when
+it's loaded and again when the response starts, and it's only written back to
+the backend if it changed.
+"""
+
+from functools import lru_cache
+import json
+import secrets
+import time
+from typing import Any, Dict, Optional, Protocol, Sequence, Tuple
+
+import itsdangerous
+from itsdangerous.exc import BadSignature
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from indieauthify_server.common.cache import LRUCache
+from indieauthify_server.common.metrics import record_cache
+from indieauthify_server.common.tokens import token_digest
+from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.dependencies.tokenstore import get_token_store
+
+
+class SessionBackend(Protocol):
+    """
+    Where the session data is kept, keyed by the digest of the session ID; the
+    version is the one in the session cookie, and changes whenever the session is saved
+    """
+
+    async def load(self, session_hash: bytes, version: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """
+        Get the serialised data and expiry time of an unexpired session
+        """
+
+    async def save(self, session_hash: bytes, data: str, expires: int, version: Optional[str] = None) -> None:
+        """
+        Add or replace a session
+        """
+
+    async def delete(self, session_hash: bytes) -> None:
+        """
+        Delete a session
+        """
+
+
+class SQLiteSessionBackend:
+    """
+    Sessions kept in the token database, so they're shared by every worker
+    """
+
+    # pylint: disable=unused-argument
+
+    async def load(self, session_hash: bytes, version: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """
+        Get the serialised data and expiry time of an unexpired session
+        """
+
+        return await get_token_store().get_session(session_hash, int(time.time()))
+
+    async def save(self, session_hash: bytes, data: str, expires: int, version: Optional[str] = None) -> None:
+        """
+        Add or replace a session
+        """
+
+        await get_token_store().save_session(session_hash, data, expires)
+
+    async def delete(self, session_hash: bytes) -> None:
+        """
+        Delete a session
+        """
+
+        await get_token_store().delete_session(session_hash)
+
+
+class CachedSessionBackend:
+    """
+    Sessions kept in a per-worker LRU cache, optionally in front of a persistent
+    backend which shares them between workers; reads are served from the cache and
+    writes go through to both
+
+    With a persistent backend, a cached session is only used if it's the version
+    the request's cookie was issued with. Every save makes a new version, and a new
+    cookie, so a session saved by another worker is read from the persistent backend
+    rather than from a stale cache entry. Without one, sessions are only suitable
+    for a single worker.
+    """
+
+    def __init__(self, maxsize: int, persistent: Optional[SessionBackend] = None) -> None:
+        self.persistent = persistent
+        self._cache: LRUCache[bytes, Tuple[str, int, Optional[str]]] = LRUCache(maxsize)
+
+    async def load(self, session_hash: bytes, version: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """
+        Get the serialised data and expiry time of an unexpired session
+        """
+
+        cached = self._cache.get(session_hash)
+        if cached is not None and (self.persistent is None or (version is not None and cached[2] == version)):
+            record_cache('session', 'hit')
+            return cached[0], cached[1]
+
+        record_cache('session', 'miss')
+        if self.persistent is None:
+            return None
+
+        stored = await self.persistent.load(session_hash, version)
+        if stored is not None and version is not None:
+            self._cache.set(session_hash, (*stored, version), ttl=stored[1] - time.time())
+
+        return stored
+
+    async def save(self, session_hash: bytes, data: str, expires: int, version: Optional[str] = None) -> None:
+        """
+        Add or replace a session
+        """
+
+        if self.persistent is not None:
+            await self.persistent.save(session_hash, data, expires, version)
+
+        self._cache.set(session_hash, (data, expires, version), ttl=expires - time.time())
+
+    async def delete(self, session_hash: bytes) -> None:
+        """
+        Delete a session
+        """
+
+        self._cache.pop(session_hash)
+        if self.persistent is not None:
+            await self.persistent.delete(session_hash)
+
+
+@lru_cache
+def get_session_backend() -> SessionBackend:
+    """
+    Get this worker's configured session backend
+    """
+
+    settings = get_settings()
+    if settings.session_backend == 'memory':
+        return CachedSessionBackend(settings.session_cache_size)
+
+    if settings.session_backend == 'sqlite':
+        return CachedSessionBackend(settings.session_cache_size, SQLiteSessionBackend())
+
+    raise ValueError(f'unknown session backend {settings.session_backend}')
+
+
+class ServerSessionMiddleware:    # pylint: disable=too-few-public-methods
+    """
+    Session middleware which keeps the session data in a SessionBackend
+    """
+
+    def __init__(    # pylint: disable=too-many-arguments
+        self,
+        app: ASGIApp,
+        secret_key: str,
+        backend: Optional[SessionBackend] = None,
+        session_cookie: str = 'session',
+        max_age: int = 14 * 24 * 60 * 60,
+        same_site: str = 'lax',
+        https_only: bool = False,
+        exclude_paths: Sequence[str] = ()
+    ) -> None:
+        self.app = app
+        self.exclude_paths = tuple(exclude_paths)
+        self.backend = backend
+        self.signer = itsdangerous.TimestampSigner(secret_key)
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.security_flags = f'httponly; samesite={same_site}'
+        if https_only:
+            self.security_flags += '; secure'
+
+    def _session_id(self, connection: HTTPConnection) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Get the session ID and version from a request's signed session cookie, if it has a valid one
+        """
+
+        cookie = connection.cookies.get(self.session_cookie)
+        if not cookie:
+            return None, None
+
+        try:
+            value = self.signer.unsign(cookie, max_age=self.max_age).decode('utf-8')
+        except BadSignature:
+            return None, None
+
+        session_id, _, version = value.partition('.')
+        return session_id, version or None
+
+    def _cookie(self, value: str, max_age: int) -> str:
+        """
+        Build the session cookie's Set-Cookie header
+        """
+
+        return f'{self.session_cookie}={value}; path=/; Max-Age={max_age}; {self.security_flags}'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] not in ('http', 'websocket') or scope['path'].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        backend = self.backend or get_session_backend()
+        session_id, version = self._session_id(HTTPConnection(scope))
+        loaded: Optional[str] = None
+        expires = 0
+
+        if session_id is not None:
+            stored = await backend.load(token_digest(session_id), version)
+            if stored is not None:
+                loaded, expires = stored
+
+        session: Dict[str, Any] = json.loads(loaded) if loaded else {}
+        scope['session'] = session
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal session_id, version
+
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(scope=message)
+                data = json.dumps(session, separators=(',', ':')) if session else None
+                now = int(time.time())
+
+                if data is not None:
+                    # write back changed sessions, and sessions past half their lifetime
+                    # so that they slide forward while they're in use; the cookie is
+                    # only re-signed when the session is written
+                    if data != loaded or expires - now < self.max_age // 2:
+                        if session_id is None or loaded is None:
+                            session_id = secrets.token_urlsafe(32)
+
+                        version = secrets.token_urlsafe(6)
+                        await backend.save(token_digest(session_id), data, now + self.max_age, version)
+                        signed = self.signer.sign(f'{session_id}.{version}').decode('utf-8')
+                        headers.append('Set-Cookie', self._cookie(signed, self.max_age))
+
+                elif loaded is not None and session_id is not None:
+                    await backend.delete(token_digest(session_id))
+                    headers.append('Set-Cookie', self._cookie('null', 0) + '; expires=Thu, 01 Jan 1970 00:00:00 GMT')
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
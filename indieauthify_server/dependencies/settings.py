@@ -29,13 +29,65 @@ class Settings(BaseSettings):
     session_key: str
     api_key: str
 
+    session_backend: str = 'sqlite'
+    session_cache_size: int = 1024
+    session_max_age: int = 1209600
+
     webhook_server: Optional[bool] = False
     webhook_url: Optional[str] = None
     webhook_api_key: Optional[str] = None
+    webhook_batch_size: int = 10
+    webhook_max_attempts: int = 8
+    webhook_backoff: float = 5.0
+    webhook_max_backoff: float = 3600.0
+    webhook_poll_interval: float = 10.0
 
     rpc_timeout: int
 
+    metadata_max_age: int = 3600
+
+    http2: bool = True
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http_max_connections_per_host: int = 10
+
+    relme_concurrency: int = 8
+    relme_deadline: float = 15.0
+    relme_refresh_interval: int = 3600
+    relme_max_stale: int = 86400
+
+    client_cache_size: int = 256
+    client_cache_ttl: int = 300
+    client_cache_max_ttl: int = 86400
+
+    profile_cache_size: int = 64
+    profile_cache_ttl: int = 3600
+    profile_cache_max_ttl: int = 86400
+    profile_max_stale: int = 86400
+
     token_db_path: Path
+    token_db_pool_size: int = 4
+    token_db_busy_timeout: int = 5000
+    token_db_cache_size: int = -8000
+    token_db_mmap_size: int = 67108864
+
+    token_gc_interval: int = 3600
+    token_gc_batch_size: int = 1000
+    token_gc_vacuum_pages: int = 1000
+
+    issued_page_size: int = 50
+    issued_max_page_size: int = 500
+
+    revocation_filter_capacity: int = 100000
+    revocation_filter_error_rate: float = 0.001
+
+    claims_cache_size: int = 1024
+
+    template_cache_dir: Path = Path('run/templates')
+
+    tracing_exporter: str = 'none'
+    tracing_file: Path = Path('run/traces.jsonl')
 
     class Config:    # pylint: disable=too-few-public-methods
         """
@@ -3,11 +3,17 @@ IndieAuthify: dependencies package; Jinja template factory module
 """
 
 from functools import lru_cache
+import logging
 from pathlib import Path
+import time
+from typing import Any, Dict
 
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
 
 from indieauthify_server.dependencies.flash import get_flash_messages, has_flash_messages
+from indieauthify_server.dependencies.settings import get_settings
 
 
 def get_template_dir() -> str:
@@ -22,15 +28,52 @@ def get_template_dir() -> str:
 @lru_cache
 def get_template_engine() -> Jinja2Templates:
     """
-    Get a template engine instance
+    Get a template engine instance; compiled templates are cached on disk, shared by
+    every worker, and in production templates aren't checked for changes once loaded
     """
 
-    engine = Jinja2Templates(directory=get_template_dir())
+    settings = get_settings()
+    settings.template_cache_dir.mkdir(parents=True, exist_ok=True)
 
-    engine.env.trim_blocks = True
-    engine.env.lstrip_blocks = True
+    engine = Jinja2Templates(
+        directory=get_template_dir(),
+        bytecode_cache=FileSystemBytecodeCache(str(settings.template_cache_dir)),
+        auto_reload=settings.app_env.lower() != 'production',
+        trim_blocks=True,
+        lstrip_blocks=True
+    )
 
     engine.env.globals['get_flash_messages'] = get_flash_messages
     engine.env.globals['has_flash_messages'] = has_flash_messages
 
     return engine
+
+
+def warm_templates() -> int:
+    """
+    Load and compile every template, so that no request has to; returns the number loaded
+    """
+
+    start = time.perf_counter()
+    env = get_template_engine().env
+    names = env.list_templates(extensions=['j2'])
+    for name in names:
+        env.get_template(name)
+
+    logging.debug('loaded %d templates in %.3fs', len(names), time.perf_counter() - start)
+    return len(names)
+
+
+def stream_template(name: str, context: Dict[str, Any], buffer_size: int = 64) -> StreamingResponse:
+    """
+    Render a template incrementally as a streamed response, so the first bytes are sent
+    before any iterables in the context have been exhausted; rendering happens on a
+    worker thread, buffer_size template chunks at a time
+    """
+
+    if 'request' not in context:
+        raise ValueError('context must include a "request" key')
+
+    stream = get_template_engine().get_template(name).stream(context)
+    stream.enable_buffering(buffer_size)
+    return StreamingResponse(stream, media_type='text/html')
@@ -0,0 +1,709 @@
+"""
+IndieAuthify: dependencies package; token store module
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from functools import lru_cache
+import logging
+from pathlib import Path
+import queue
+import sqlite3
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from indieauthify_server.common.bloom import BloomFilter
+from indieauthify_server.common.metrics import DB_DURATION, record_cache
+from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.migrations import migrate
+
+T = TypeVar('T')
+
+AUTO_VACUUM_INCREMENTAL = 2
+EXPIRING_TABLES = ('issued_tokens', 'revoked_tokens', 'tickets', 'sessions')
+
+
+def operation_name(func: Callable) -> str:
+    """
+    Name a query function for the query timings; the TokenStore method it's defined in
+    """
+
+    return func.__qualname__.split('.<locals>', 1)[0].rsplit('.', 1)[-1]
+
+
+class TokenStoreBusy(Exception):
+    """
+    No pooled connection became free within the busy timeout
+    """
+
+
+class TokenStore:    # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    A per-worker pool of prepared, reusable SQLite connections to the token database
+
+    Blocking SQLite work is kept off the event loop; reads run on a thread pool
+    over the pooled connections and writes are serialised through a single
+    writer thread with its own dedicated connection.
+
+    Revoked tokens are indexed in a per-worker Bloom filter so that checking a
+    token which hasn't been revoked, by far the common case, doesn't touch the
+    revoked_tokens table. Revocations made by other workers are picked up by
+    watching PRAGMA data_version, on a reader thread, and loading any newly
+    revoked rows.
+    """
+
+    def __init__(    # pylint: disable=too-many-arguments
+        self,
+        path: Path,
+        pool_size: int = 4,
+        busy_timeout: int = 5000,
+        cache_size: int = -8000,
+        mmap_size: int = 67108864,
+        revocation_capacity: int = 100000,
+        revocation_error_rate: float = 0.001
+    ) -> None:
+        self.path = path
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+        self._writer_connection: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._readers: Optional[ThreadPoolExecutor] = None
+
+        self._revoked = BloomFilter(revocation_capacity, revocation_error_rate)
+        self._revoked_rowid = 0
+        self._revoked_version: Optional[int] = None
+        self._version_connection: Optional[sqlite3.Connection] = None
+        self._version_lock = threading.Lock()
+        self._revocation_lock = asyncio.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a new connection and apply the per-connection pragmas
+        """
+
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False
+        )
+        # only takes effect when the database is created, so it must come before journal_mode;
+        # see python -m indieauthify_server.compaction --vacuum for existing databases
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        connection.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        connection.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        connection.execute('PRAGMA temp_store = MEMORY')
+        return connection
+
+    def _acquire(self) -> sqlite3.Connection:
+        """
+        Take a connection from the pool, opening a new one if the pool isn't yet full;
+        raises TokenStoreBusy if none is returned to the pool within the busy timeout
+        """
+
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._connections) < self.pool_size:
+                connection = self._connect()
+                self._connections.append(connection)
+                return connection
+
+        try:
+            return self._pool.get(timeout=self.busy_timeout / 1000)
+        except queue.Empty as exc:
+            raise TokenStoreBusy(f'no token store connection was free within {self.busy_timeout}ms') from exc
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a pooled connection for the duration of a transaction
+        """
+
+        connection = self._acquire()
+        try:
+            with connection:
+                yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _run_read(self, func: Callable[..., T], args: tuple) -> T:
+        """
+        Run a read function on a pooled connection; called on a reader thread
+        """
+
+        with DB_DURATION.labels(operation_name(func)).time():
+            with self.connection() as connection:
+                return func(connection, *args)
+
+    def _run_write(self, func: Callable[..., T], args: tuple) -> T:
+        """
+        Run a write function in a transaction on the writer connection; called on the writer thread
+        """
+
+        if self._writer_connection is None:
+            self._writer_connection = self._connect()
+
+        with DB_DURATION.labels(operation_name(func)).time():
+            with self._writer_connection:
+                return func(self._writer_connection, *args)
+
+    async def read(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Await func(connection, *args) run on the reader thread pool
+        """
+
+        if self._readers is None:
+            self.open()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, func, args)
+
+    async def write(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Await func(connection, *args) run as a single transaction on the writer thread
+        """
+
+        if self._writer is None:
+            self.open()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run_write, func, args)
+
+    @staticmethod
+    def _fetch_revocations(connection: sqlite3.Connection, after: int) -> List[Tuple[int, bytes]]:
+        """
+        Get the digests of the tokens revoked since the given rowid
+        """
+
+        return connection.execute(
+            'SELECT id, token_hash FROM revoked_tokens WHERE id > ? ORDER BY id',
+            (after,
+            )
+        ).fetchall()
+
+    def _add_revocations(self, rows: Iterable[Tuple[int, bytes]]) -> None:
+        """
+        Add revoked token digests to the revocation filter
+        """
+
+        for rowid, token_hash in rows:
+            self._revoked.add(token_hash)
+            self._revoked_rowid = max(self._revoked_rowid, rowid)
+
+    def _data_version(self) -> int:
+        """
+        The database's data version; changes whenever another connection commits.
+        Blocking, as it can wait on the busy timeout, so not for the event loop
+        """
+
+        # data_version is only comparable between calls on the same connection
+        with self._version_lock:
+            if self._version_connection is None:
+                self._version_connection = self._connect()
+
+            return self._version_connection.execute('PRAGMA data_version').fetchone()[0]
+
+    async def _read_data_version(self) -> int:
+        """
+        Await the database's data version, read on the reader thread pool
+        """
+
+        if self._readers is None:
+            self.open()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._data_version)
+
+    def _load_revocations(self) -> None:
+        """
+        Load every revoked token into the revocation filter
+        """
+
+        version = self._data_version()
+        with self.connection() as connection:
+            self._add_revocations(
+                connection.execute(
+                    'SELECT id, token_hash FROM revoked_tokens WHERE id > ?',
+                    (self._revoked_rowid,
+                    )
+                )
+            )
+
+        self._revoked_version = version
+        logging.debug(
+            'loaded %d revoked tokens into a %d byte revocation filter',
+            len(self._revoked),
+            self._revoked.size
+        )
+
+    async def _sync_revocations(self) -> None:
+        """
+        Load any tokens revoked since the revocation filter was last synced
+        """
+
+        # PRAGMA data_version only reads the database header, not the table
+        if await self._read_data_version() == self._revoked_version:
+            return
+
+        async with self._revocation_lock:
+            version = await self._read_data_version()
+            if version == self._revoked_version:
+                return
+
+            self._add_revocations(await self.read(self._fetch_revocations, self._revoked_rowid))
+            self._revoked_version = version
+
+    async def is_revoked(self, token_hash: bytes) -> bool:
+        """
+        Has the token with this digest been revoked?
+        """
+
+        await self._sync_revocations()
+        if token_hash not in self._revoked:
+            record_cache('revocation_filter', 'negative')
+            return False
+
+        record_cache('revocation_filter', 'positive')
+
+        def query(connection: sqlite3.Connection) -> bool:
+            row = connection.execute('SELECT 1 FROM revoked_tokens WHERE token_hash = ?', (token_hash,)).fetchone()
+            return row is not None
+
+        return await self.read(query)
+
+    async def revoke_token(self, token_hash: bytes, expires: int | None = None) -> None:
+        """
+        Add the token with this digest to the revoked tokens; once the token's expiry
+        time has passed the revocation can be compacted away
+        """
+
+        def query(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                'INSERT OR IGNORE INTO revoked_tokens (token_hash, expires) VALUES (?, ?)',
+                (token_hash,
+                 expires)
+            )
+
+        await self.write(query)
+        self._revoked.add(token_hash)
+
+    async def revoke_tokens(
+        self,
+        tokens: Sequence[Tuple[bytes, Optional[int]]],
+        client_id: Optional[str] = None,
+        me: Optional[str] = None,    # pylint: disable=invalid-name
+        created_before: Optional[str] = None
+    ) -> Tuple[List[bytes], int, int]:
+        """
+        Revoke the (digest, expiry) tokens given, and every issued token matching all
+        of the client_id, me and created_before filters given, in a single transaction,
+        deleting them from the issued tokens; returns the digests of the tokens revoked,
+        the number of revocations added and the number of issued tokens deleted
+        """
+
+        filters = {'client_id = ?': client_id, 'me = ?': me, 'created < ?': created_before}
+        conditions = {condition: value for condition, value in filters.items() if value is not None}
+
+        def query(connection: sqlite3.Connection) -> Tuple[List[bytes], int, int]:
+            revocations = dict(tokens)
+            if conditions:
+                revocations.update(
+                    connection.execute(
+                        f'SELECT token_hash, expires FROM issued_tokens WHERE {" AND ".join(conditions)}',
+                        tuple(conditions.values())
+                    )
+                )
+
+            # tokens given by digest take their expiry time from the issued token, if there is one
+            added = connection.executemany(
+                'INSERT OR IGNORE INTO revoked_tokens (token_hash, expires) '
+                'VALUES (?, COALESCE(?, (SELECT expires FROM issued_tokens WHERE token_hash = ?)))',
+                ((token_hash, expires, token_hash) for token_hash, expires in revocations.items())
+            ).rowcount
+            deleted = connection.executemany(
+                'DELETE FROM issued_tokens WHERE token_hash = ?',
+                ((token_hash,) for token_hash in revocations)
+            ).rowcount
+            return list(revocations), added, deleted
+
+        revoked, added, deleted = await self.write(query)
+        for token_hash in revoked:
+            self._revoked.add(token_hash)
+
+        return revoked, added, deleted
+
+    async def get_ticket(self, token_hash: bytes) -> Optional[tuple]:
+        """
+        Get the ticket for the ticket token with this digest
+        """
+
+        def query(connection: sqlite3.Connection) -> Optional[tuple]:
+            return connection.execute('SELECT * FROM tickets WHERE token_hash = ?', (token_hash,)).fetchone()
+
+        return await self.read(query)
+
+    async def get_issued_token(self, token_hash: bytes) -> Optional[tuple]:
+        """
+        Get the issued token with this digest
+        """
+
+        def query(connection: sqlite3.Connection) -> Optional[tuple]:
+            return connection.execute('SELECT * FROM issued_tokens WHERE token_hash = ?', (token_hash,)).fetchone()
+
+        return await self.read(query)
+
+    async def get_issued_tokens(self, limit: int, before: Optional[Tuple[str, int]] = None) -> List[tuple]:
+        """
+        Get a page of at most limit issued tokens, newest first, starting after the
+        (created, rowid) keyset of the last token on the previous page; each row is
+        an issued_tokens row followed by its rowid
+        """
+
+        return await self.read(self._fetch_issued_tokens, limit, before)
+
+    @staticmethod
+    def _fetch_issued_tokens(connection: sqlite3.Connection, limit: int, before: Optional[Tuple[str, int]]) -> List[tuple]:
+        """
+        Get a keyset page of issued tokens, each followed by its rowid
+        """
+
+        if before is None:
+            return connection.execute(
+                'SELECT *, rowid FROM issued_tokens ORDER BY created DESC, rowid DESC LIMIT ?',
+                (limit,
+                )
+            ).fetchall()
+
+        return connection.execute(
+            'SELECT *, rowid FROM issued_tokens WHERE (created, rowid) < (?, ?) '
+            'ORDER BY created DESC, rowid DESC LIMIT ?',
+            (*before,
+             limit)
+        ).fetchall()
+
+    def iter_issued_tokens(self, batch_size: int = 100) -> Iterator[tuple]:
+        """
+        Iterate over every issued token, newest first, fetching keyset pages of
+        batch_size rows; blocking, so meant to be consumed on a worker thread. Each
+        page borrows a pooled connection only while it's fetched, so a slow reader
+        of the iterator doesn't hold a connection
+        """
+
+        before: Optional[Tuple[str, int]] = None
+        while True:
+            with self.connection() as connection:
+                rows = self._fetch_issued_tokens(connection, batch_size, before)
+
+            for row in rows:
+                yield row[:-1]
+
+            if len(rows) < batch_size:
+                return
+
+            before = (rows[-1][2], rows[-1][-1])
+
+    async def replace_issued_token(    # pylint: disable=too-many-arguments
+        self,
+        token_hash: bytes,
+        me: str,    # pylint: disable=invalid-name
+        created: str,
+        client_id: str,
+        expires: int,
+        app_item: str
+    ) -> None:
+        """
+        Issue a token to a client, deleting any tokens already issued to that client
+        so that more than one token cannot be active per client
+        """
+
+        def query(connection: sqlite3.Connection) -> None:
+            connection.execute('DELETE FROM issued_tokens WHERE client_id = ?', (client_id,))
+            connection.execute(
+                'INSERT INTO issued_tokens VALUES (?, ?, ?, ?, ?, ?)',
+                (token_hash,
+                 me,
+                 created,
+                 client_id,
+                 expires,
+                 app_item)
+            )
+
+        await self.write(query)
+
+    async def delete_issued_token(self, token_hash: bytes | None = None) -> None:
+        """
+        Delete the issued token with this digest, or all issued tokens if no digest is given
+        """
+
+        def query(connection: sqlite3.Connection) -> None:
+            if token_hash is None:
+                connection.execute('DELETE FROM issued_tokens')
+            else:
+                connection.execute('DELETE FROM issued_tokens WHERE token_hash = ?', (token_hash,))
+
+        await self.write(query)
+
+    async def get_session(self, session_hash: bytes, now: int) -> Optional[Tuple[str, int]]:
+        """
+        Get the data and expiry time of the unexpired session with this digest
+        """
+
+        def query(connection: sqlite3.Connection) -> Optional[Tuple[str, int]]:
+            return connection.execute(
+                'SELECT data, expires FROM sessions WHERE session_hash = ? AND expires >= ?',
+                (session_hash,
+                 now)
+            ).fetchone()
+
+        return await self.read(query)
+
+    async def save_session(self, session_hash: bytes, data: str, expires: int) -> None:
+        """
+        Add or replace the session with this digest
+        """
+
+        def query(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                'INSERT OR REPLACE INTO sessions (session_hash, data, expires) VALUES (?, ?, ?)',
+                (session_hash,
+                 data,
+                 expires)
+            )
+
+        await self.write(query)
+
+    async def delete_session(self, session_hash: bytes) -> None:
+        """
+        Delete the session with this digest
+        """
+
+        def query(connection: sqlite3.Connection) -> None:
+            connection.execute('DELETE FROM sessions WHERE session_hash = ?', (session_hash,))
+
+        await self.write(query)
+
+    async def enqueue_webhook(self, url: str, payload: str, now: float) -> None:
+        """
+        Add a webhook notification to the delivery queue
+        """
+
+        def query(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                'INSERT INTO webhook_queue (url, payload, created, next_attempt) VALUES (?, ?, ?, ?)',
+                (url,
+                 payload,
+                 now,
+                 now)
+            )
+
+        await self.write(query)
+
+    async def claim_webhooks(self, now: float, lease: float, limit: int) -> List[tuple]:
+        """
+        Claim up to limit due webhook notifications for delivery, for lease seconds, so
+        that no other worker delivers them meanwhile; returns (id, url, payload, created,
+        attempts) rows
+        """
+
+        def query(connection: sqlite3.Connection) -> List[tuple]:
+            return connection.execute(
+                """
+                UPDATE webhook_queue SET claimed_until = ?
+                WHERE id IN (
+                    SELECT id FROM webhook_queue
+                    WHERE next_attempt <= ? AND (claimed_until IS NULL OR claimed_until < ?)
+                    ORDER BY next_attempt LIMIT ?
+                )
+                RETURNING id, url, payload, created, attempts
+                """,
+                (now + lease,
+                 now,
+                 now,
+                 limit)
+            ).fetchall()
+
+        return await self.write(query)
+
+    async def settle_webhooks(
+        self,
+        delivered: List[int],
+        retries: List[Tuple[int, float, str]],
+        dead: List[Tuple[int, float, str]]
+    ) -> None:
+        """
+        Record the outcome of a batch of deliveries; delete the delivered notifications,
+        reschedule the (id, next_attempt, error) retries and move the (id, failed, error)
+        dead notifications to the dead letter table
+        """
+
+        def query(connection: sqlite3.Connection) -> None:
+            connection.executemany('DELETE FROM webhook_queue WHERE id = ?', ((id_,) for id_ in delivered))
+            connection.executemany(
+                'UPDATE webhook_queue SET attempts = attempts + 1, next_attempt = ?, '
+                'claimed_until = NULL, last_error = ? WHERE id = ?',
+                ((next_attempt, error, id_) for id_, next_attempt, error in retries)
+            )
+            connection.executemany(
+                'INSERT INTO webhook_dead_letters (id, url, payload, created, attempts, failed, last_error) '
+                'SELECT id, url, payload, created, attempts + 1, ?, ? FROM webhook_queue WHERE id = ?',
+                ((failed, error, id_) for id_, failed, error in dead)
+            )
+            connection.executemany('DELETE FROM webhook_queue WHERE id = ?', ((id_,) for id_, _, _ in dead))
+
+        await self.write(query)
+
+    async def acquire_lease(self, name: str, holder: str, now: float, duration: float) -> bool:
+        """
+        Take, or renew, the named lease for duration seconds, unless another holder
+        has it and it hasn't yet expired; returns whether holder now has the lease
+        """
+
+        def query(connection: sqlite3.Connection) -> bool:
+            return connection.execute(
+                'INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires '
+                'WHERE leases.expires <= ? OR leases.holder = excluded.holder',
+                (name,
+                 holder,
+                 now + duration,
+                 now)
+            ).rowcount == 1
+
+        return await self.write(query)
+
+    async def delete_expired(self, table: str, now: int, batch_size: int) -> int:
+        """
+        Delete the rows in a table that expired before now, in batches of at most
+        batch_size rows so that the writer thread is never held for long; returns
+        the number of rows deleted
+        """
+
+        if table not in EXPIRING_TABLES:
+            raise ValueError(f'{table} has no expiring rows')
+
+        statement = (
+            f'DELETE FROM {table} WHERE rowid IN '
+            f'(SELECT rowid FROM {table} WHERE expires < ? ORDER BY expires LIMIT ?)'
+        )
+
+        def query(connection: sqlite3.Connection) -> int:
+            return connection.execute(statement, (now, batch_size)).rowcount
+
+        deleted = 0
+        while True:
+            batch = await self.write(query)
+            deleted += batch
+            if batch < batch_size:
+                return deleted
+
+    async def optimize(self, vacuum_pages: int) -> int:
+        """
+        Return up to vacuum_pages free pages to the file system, if the database is in
+        incremental auto-vacuum mode, and refresh the query planner's statistics;
+        returns the number of pages freed
+        """
+
+        def query(connection: sqlite3.Connection) -> int:
+            freed = 0
+            if connection.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+                before = connection.execute('PRAGMA freelist_count').fetchone()[0]
+                connection.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})').fetchall()
+                freed = before - connection.execute('PRAGMA freelist_count').fetchone()[0]
+
+            connection.execute('PRAGMA optimize')
+            return freed
+
+        return await self.write(query)
+
+    def open(self) -> None:
+        """
+        Migrate the schema, pre-fill the pool and start the reader and writer threads
+        so the first requests don't pay the connection cost
+        """
+
+        logging.debug('opening token store %s with %d connections', self.path, self.pool_size)
+        with self._lock:
+            if not self._connections:
+                connection = self._connect()
+                try:
+                    migrate(connection)
+                finally:
+                    connection.close()
+
+            while len(self._connections) < self.pool_size:
+                connection = self._connect()
+                self._connections.append(connection)
+                self._pool.put(connection)
+
+            if self._readers is None:
+                self._readers = ThreadPoolExecutor(
+                    max_workers=self.pool_size,
+                    thread_name_prefix='tokenstore-reader'
+                )
+
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tokenstore-writer')
+
+        if self._revoked_version is None:
+            self._load_revocations()
+
+    def close(self) -> None:
+        """
+        Stop the reader and writer threads and close every connection
+        """
+
+        logging.debug('closing token store %s', self.path)
+        for executor in (self._readers, self._writer):
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+        self._readers = None
+        self._writer = None
+
+        for connection in (self._writer_connection, self._version_connection):
+            if connection is not None:
+                connection.close()
+
+        self._writer_connection = None
+        self._version_connection = None
+
+        with self._lock:
+            while not self._pool.empty():
+                self._pool.get_nowait()
+
+            for connection in self._connections:
+                connection.close()
+
+            self._connections.clear()
+
+
+@lru_cache
+def get_token_store() -> TokenStore:
+    """
+    Get the token store for this worker
+    """
+
+    settings = get_settings()
+    return TokenStore(
+        settings.token_db_path,
+        pool_size=settings.token_db_pool_size,
+        busy_timeout=settings.token_db_busy_timeout,
+        cache_size=settings.token_db_cache_size,
+        mmap_size=settings.token_db_mmap_size,
+        revocation_capacity=settings.revocation_filter_capacity,
+        revocation_error_rate=settings.revocation_filter_error_rate
+    )
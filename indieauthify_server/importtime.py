@@ -0,0 +1,112 @@
+"""
+IndieAuthify: startup import time profiling module
+
+Imports a module, by default the server, in a fresh interpreter with Python's
+-X importtime and reports where the time went, heaviest first. With --budget it
+exits non-zero if the import took longer than the budget, or if it imported any
+of the modules the server only imports on first use, so that it can guard
+startup time in CI:
+
+    python -m indieauthify_server.importtime [--top 20] [--budget 1500]
+"""
+
+import argparse
+from collections import defaultdict
+import re
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple
+
+# The HTML parsing, IndieAuth and OAuth client stacks; they're imported where
+# they're used rather than at module level, so that importing the server, or any
+# tool built on the package, doesn't pay for them until a request needs them
+DEFERRED_IMPORTS = (
+    'authlib.integrations.starlette_client',
+    'bs4',
+    'indieweb_utils',
+    'jwt',
+    'mf2py',
+)
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+class ImportTime(NamedTuple):
+    """
+    The time to import one module, in microseconds; self excludes the module's own imports
+    """
+
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def profile(module: str) -> List[ImportTime]:
+    """
+    Import a module in a fresh interpreter and return the time taken by every module it imported
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        check=False,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'importing {module} failed:\n{result.stderr}')
+
+    times = []
+    for line in result.stderr.splitlines():
+        if match := IMPORT_TIME.match(line):
+            times.append(ImportTime(match.group(4), int(match.group(1)), int(match.group(2))))
+
+    return times
+
+
+def main() -> None:
+    """
+    Profile the import of a module
+    """
+
+    parser = argparse.ArgumentParser(description='Report where the time goes when importing the server')
+    parser.add_argument('--module', default='indieauthify_server.server', help='the module to import')
+    parser.add_argument('--top', type=int, default=20, help='how many packages and modules to list')
+    parser.add_argument('--runs', type=int, default=3, help='import this many times and report the fastest')
+    parser.add_argument('--budget', type=float, help='fail if the import takes longer than this many milliseconds')
+    args = parser.parse_args()
+
+    runs = [profile(args.module) for _ in range(args.runs)]
+    times = min(runs, key=lambda run: next(time.cumulative_us for time in run if time.module == args.module))
+    total = next(time.cumulative_us for time in times if time.module == args.module) / 1000
+
+    packages: Dict[str, int] = defaultdict(int)
+    for time in times:
+        packages[time.module.split('.', 1)[0]] += time.self_us
+
+    print(f'importing {args.module} took {total:.1f}ms, fastest of {args.runs}\n')
+    print('by package, excluding the packages they import')
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f'{self_us / 1000:9.1f}ms  {package}')
+
+    print('\nby module, including the modules they import')
+    for time in sorted(times, key=lambda time: time.cumulative_us, reverse=True)[:args.top]:
+        print(f'{time.cumulative_us / 1000:9.1f}ms  {time.module}')
+
+    deferred = sorted(name for name in DEFERRED_IMPORTS if name.split('.', 1)[0] in packages)
+    if deferred:
+        print(f'\nimported modules that should be deferred: {", ".join(deferred)}')
+
+    if args.budget is not None:
+        if total > args.budget:
+            print(f'\nFAIL: {total:.1f}ms is over the budget of {args.budget:.0f}ms')
+            sys.exit(1)
+
+        if deferred:
+            print('\nFAIL: deferred modules were imported')
+            sys.exit(1)
+
+        print(f'\nOK: {total:.1f}ms is within the budget of {args.budget:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
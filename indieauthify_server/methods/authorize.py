@@ -5,12 +5,12 @@ IndieAuthify: methods package; authorize method handler module
 from http import HTTPStatus
 from urllib.parse import urlparse as parse_url
 
-from bs4 import BeautifulSoup
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse, RedirectResponse, Response
-import indieweb_utils
-import jwt
-import requests
+from fastapi.responses import RedirectResponse, Response
+import httpx
+from indieauthify_server.common.client import InvalidClientId, get_client_metadata_cache
+from indieauthify_server.common.responses import JSONResponse
+from indieauthify_server.common.tracing import span
 from indieauthify_server.common.url import normalise_url
 
 from indieauthify_server.dependencies.settings import get_settings
@@ -28,38 +28,42 @@ async def authorize_handler(    # pylint: disable=too-many-arguments,too-many-re
     GET POST /auth
     """
 
-    if request.method == 'GET':
+    # pylint: disable=import-outside-toplevel
+    import indieweb_utils
+    import jwt
 
-        domain_uri = params.me
-        session_uri = request.session.get('me')
-        if domain_uri and session_uri and normalise_url(
-            domain_uri,
-            noslash=True,
-            noscheme=False
-        ) != normalise_url(
-            session_uri,
-            noslash=True,
-            noscheme=False
-        ):
-            request.session.pop('logged_in', None)
-            request.session.pop('me', None)
-
-            message = f"""
-                {params.client_id} is requesting you to sign in as {params.me}.
-                Please sign in as {params.me}.
-                """
-
-            flash_message(request, message, 'warning')
-            return RedirectResponse(
-                url=str(request.url_for('get_login_page',
-                                        **{'r': request.url}))
-            )
+    if request.method == 'GET':
+        with span('authorize.session', me=params.me):
+            domain_uri = params.me
+            session_uri = request.session.get('me')
+            if domain_uri and session_uri and normalise_url(
+                domain_uri,
+                noslash=True,
+                noscheme=False
+            ) != normalise_url(
+                session_uri,
+                noslash=True,
+                noscheme=False
+            ):
+                request.session.pop('logged_in', None)
+                request.session.pop('me', None)
+
+                message = f"""
+                    {params.client_id} is requesting you to sign in as {params.me}.
+                    Please sign in as {params.me}.
+                    """
+
+                flash_message(request, message, 'warning')
+                return RedirectResponse(
+                    url=str(request.url_for('get_login_page',
+                                            **{'r': request.url}))
+                )
 
-        if request.session.get("logged_in") is not True:
-            return RedirectResponse(
-                url=str(request.url_for('get_login_page',
-                                        **{'r': request.url}))
-            )
+            if request.session.get("logged_in") is not True:
+                return RedirectResponse(
+                    url=str(request.url_for('get_login_page',
+                                            **{'r': request.url}))
+                )
 
         if not params.client_id or not params.redirect_uri or not params.response_type or not params.state:
             return JSONResponse(
@@ -73,60 +77,31 @@ async def authorize_handler(    # pylint: disable=too-many-arguments,too-many-re
                 content={'error': 'invalid_request'}
             )
 
-        settings = get_settings()
-        try:
-            client_id_app = requests.get(params.client_id, timeout=settings.rpc_timeout)
-        except requests.RequestException as exc:
-            return JSONResponse(
-                status_code=HTTPStatus.BAD_REQUEST,
-                content={
-                    'error': 'invalid_request',
-                    'details': exc
-                }
-            )
-
-        h_app_item = None
-
-        redirect_uri_domain = parse_url(params.redirect_uri).netloc
-        client_id_domain = parse_url(params.client_id).netloc
-
-        redirect_uri_scheme = parse_url(params.redirect_uri).scheme
-        client_id_scheme = parse_url(params.client_id).scheme
-
-        if (redirect_uri_domain != client_id_domain or redirect_uri_scheme != client_id_scheme):
-            fetch_client = requests.get(params.client_id, timeout=settings.rpc_timeout)
-
-            confirmed_redirect_uri = False
-
-            links = indieweb_utils.discover_endpoints(params.client_id, ['redirect_uri'])
-
-            for url in links:
-                if url.startswith('/'):
-                    url = f'{redirect_uri_scheme}{normalise_url(redirect_uri_domain, noslash=True, noscheme=False)}{url}'
-
-                if url == params.redirect_uri:
-                    confirmed_redirect_uri = True
-
-            link_tags = BeautifulSoup(fetch_client.text, 'lxml').find_all('link')
-
-            for link in link_tags:
-                if link.get('rel') == 'redirect_uri':
-                    url = link.get('href')
-
-                    if url.startswith('/'):
-                        url = f'{redirect_uri_scheme}{normalise_url(redirect_uri_domain, noslash=True, noscheme=False)}{url}'
-
-                    if url == params.redirect_uri:
-                        confirmed_redirect_uri = True
-
-            if not confirmed_redirect_uri:
+        with span('authorize.client_metadata', client_id=params.client_id):
+            try:
+                client = await get_client_metadata_cache().get(params.client_id)
+            except (InvalidClientId, httpx.HTTPError) as exc:
                 return JSONResponse(
                     status_code=HTTPStatus.BAD_REQUEST,
-                    content={'error': 'invalid_request'}
+                    content={
+                        'error': 'invalid_request',
+                        'details': exc
+                    }
                 )
 
-        if client_id_app.status_code == 200:
-            h_app_item = indieweb_utils.get_h_app_item(client_id_app.text)
+        with span('authorize.redirect_uri', redirect_uri=params.redirect_uri):
+            redirect_uri_domain = parse_url(params.redirect_uri).netloc
+            client_id_domain = parse_url(params.client_id).netloc
+
+            redirect_uri_scheme = parse_url(params.redirect_uri).scheme
+            client_id_scheme = parse_url(params.client_id).scheme
+
+            if (redirect_uri_domain != client_id_domain or redirect_uri_scheme != client_id_scheme):
+                if params.redirect_uri not in client.redirect_uris:
+                    return JSONResponse(
+                        status_code=HTTPStatus.BAD_REQUEST,
+                        content={'error': 'invalid_request'}
+                    )
 
         args = {
             'request': request,
@@ -138,67 +113,71 @@ async def authorize_handler(    # pylint: disable=too-many-arguments,too-many-re
             'state': params.state,
             'code_challenge': params.code_challenge,
             'code_challenge_method': params.code_challenge_method,
-            'h_app_item': h_app_item,
+            'h_app_item': client.h_app_item,
             'SCOPE_DEFINITIONS': indieweb_utils.SCOPE_DEFINITIONS,
             'title': f"Authenticate to {normalise_url(params.client_id, noslash=False, noscheme=True).strip()}"
         }
 
-        return get_template_engine().TemplateResponse('confirm_auth.html.j2', args)
-
-    try:
-        indieweb_utils.validate_authorization_response(
-            params.grant_type,
-            params.code,
-            params.client_id,
-            params.redirect_uri,
-            params.code_challenge,
-            params.code_challenge_method,
-        )
-    except indieweb_utils.indieauth.server.TokenValidationError as exc:
-        return JSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={
-                'error': exc,
-                'details': exc
-            }
-        )
+        with span('authorize.render', template='confirm_auth.html.j2'):
+            return get_template_engine().TemplateResponse('confirm_auth.html.j2', args)
+
+    with span('authorize.validate_response', client_id=params.client_id):
+        try:
+            indieweb_utils.validate_authorization_response(
+                params.grant_type,
+                params.code,
+                params.client_id,
+                params.redirect_uri,
+                params.code_challenge,
+                params.code_challenge_method,
+            )
+        except indieweb_utils.indieauth.server.TokenValidationError as exc:
+            return JSONResponse(
+                status_code=HTTPStatus.BAD_REQUEST,
+                content={
+                    'error': 'invalid_request',
+                    'details': exc
+                }
+            )
 
     settings = get_settings()
-    try:
-        decoded_code = jwt.decode(params.code, settings.session_key, algorithms=['HS256'])
-    except jwt.DecodeError as exc:
-        return JSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={
-                'error': 'invalid_grant',
-                'details': exc
-            }
-        )
-
-    try:
-        indieweb_utils.indieauth.server.verify_decoded_code(
-            params.client_id,
-            params.redirect_uri,
-            decoded_code['client_id'],
-            decoded_code['redirect_uri'],
-            decoded_code['expires'],
-        )
-    except indieweb_utils.indieauth.server.AuthorizationCodeExpiredError as exc:
-        return JSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={
-                'error': 'invalid_request',
-                'details': exc
-            }
-        )
-    except indieweb_utils.indieauth.server.TokenValidationError as exc:
-        return JSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={
-                'error': 'invalid_request',
-                'details': exc
-            }
-        )
+    with span('authorize.decode_code'):
+        try:
+            decoded_code = jwt.decode(params.code, settings.session_key, algorithms=['HS256'])
+        except jwt.DecodeError as exc:
+            return JSONResponse(
+                status_code=HTTPStatus.BAD_REQUEST,
+                content={
+                    'error': 'invalid_grant',
+                    'details': exc
+                }
+            )
+
+    with span('authorize.verify_code'):
+        try:
+            indieweb_utils.indieauth.server.verify_decoded_code(
+                params.client_id,
+                params.redirect_uri,
+                decoded_code['client_id'],
+                decoded_code['redirect_uri'],
+                decoded_code['expires'],
+            )
+        except indieweb_utils.indieauth.server.AuthorizationCodeExpiredError as exc:
+            return JSONResponse(
+                status_code=HTTPStatus.BAD_REQUEST,
+                content={
+                    'error': 'invalid_request',
+                    'details': exc
+                }
+            )
+        except indieweb_utils.indieauth.server.TokenValidationError as exc:
+            return JSONResponse(
+                status_code=HTTPStatus.BAD_REQUEST,
+                content={
+                    'error': 'invalid_request',
+                    'details': exc
+                }
+            )
 
     return JSONResponse(
         status_code=HTTPStatus.OK,
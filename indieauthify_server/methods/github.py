@@ -2,31 +2,42 @@
 IndieAuthify: methods package; GitHub authorization method handlers module
 """
 
+from functools import lru_cache
 import logging
 import secrets
+from typing import Any
 
-from authlib.integrations.starlette_client import OAuth, OAuthError
 from fastapi.requests import Request
 from fastapi.responses import RedirectResponse, Response
-import indieweb_utils
 from pydantic import HttpUrl
 
+from indieauthify_server.common.relme import get_relme_cache, get_relme_links
 from indieauthify_server.dependencies.settings import get_settings
 from indieauthify_server.dependencies.flash import flash_message
 
 settings = get_settings()
-oauth = OAuth()
-github = oauth.register(
-    name='github',
-    client_id=settings.github_client_id,
-    client_secret=settings.github_client_secret,
-    access_token_url=settings.github_token_url,
-    access_token_params=None,
-    authorize_url=settings.github_authorize_url,
-    authorize_params=None,
-    api_base_url=settings.github_base_url,
-    client_kwargs={'scope': 'user:email'}
-)
+
+
+@lru_cache
+def get_github_client() -> Any:
+    """
+    Get the GitHub OAuth client, registering it on first use
+    """
+
+    from authlib.integrations.starlette_client import OAuth    # pylint: disable=import-outside-toplevel
+
+    oauth = OAuth()
+    return oauth.register(
+        name='github',
+        client_id=settings.github_client_id,
+        client_secret=settings.github_client_secret,
+        access_token_url=settings.github_token_url,
+        access_token_params=None,
+        authorize_url=settings.github_authorize_url,
+        authorize_params=None,
+        api_base_url=settings.github_base_url,
+        client_kwargs={'scope': 'user:email'}
+    )
 
 
 async def github_login_handler(request: Request) -> Response:
@@ -44,7 +55,7 @@ async def github_login_handler(request: Request) -> Response:
         request.url.path,
         redirect_uri
     )
-    return await oauth.github.authorize_redirect(request, redirect_uri, state=state)
+    return await get_github_client().authorize_redirect(request, redirect_uri, state=state)
 
 
 async def github_authenticate_handler(request: Request, state: str) -> Response:
@@ -53,6 +64,8 @@ async def github_authenticate_handler(request: Request, state: str) -> Response:
     GET /auth/github/callback
     """
 
+    from authlib.integrations.starlette_client import OAuthError    # pylint: disable=import-outside-toplevel
+
     logging.debug('%s %s - github_authenticate_handler', request.method, request.url.path)
     if state != request.session.get('github_state'):
         logging.error('%s: GitHub state token mismatch; bouncing to login page', request.url.path)
@@ -63,10 +76,10 @@ async def github_authenticate_handler(request: Request, state: str) -> Response:
 
     logging.debug('%s: GitHub says yes, getting access token', request.url.path)
     try:
-        token = await oauth.github.authorize_access_token(request)
+        token = await get_github_client().authorize_access_token(request)
         logging.debug('%s: got access token, getting user profile', request.url.path)
 
-        rsp = await oauth.github.get('user', token=token)
+        rsp = await get_github_client().get('user', token=token)
         profile = rsp.json()
 
         profile_name = profile.get('login')    # pylint: disable=invalid-name
@@ -106,7 +119,10 @@ async def is_authenticated_as_allowed_user(me_domain: HttpUrl, profile_url: str)
     Check if the allowed user has a valid rel=me link pointing to their domain.
     """
 
-    home_me_links = indieweb_utils.get_valid_relmeauth_links(me_domain)
+    if me_domain == settings.me:
+        home_me_links = await get_relme_cache().get()
+    else:
+        home_me_links = await get_relme_links(me_domain, require_link_back=True)
 
     for link in home_me_links:
         if link.strip('/') == profile_url.strip('/'):
@@ -2,19 +2,38 @@
 IndieAuthify: methods package; metadata method handler module
 """
 
+from functools import lru_cache
+import hashlib
 from http import HTTPStatus
+from typing import NamedTuple
 
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
-import indieweb_utils
+from fastapi.responses import Response
 
+from indieauthify_server.common.cache import LRUCache
+from indieauthify_server.common.metrics import record_cache
+from indieauthify_server.common.responses import JSONResponse
+from indieauthify_server.dependencies.settings import get_settings
 
-async def metadata_handler(request: Request) -> JSONResponse:
+# the base URL comes from the request's Host header, so only keep a handful
+METADATA_CACHE_SIZE = 16
+
+
+class EncodedMetadata(NamedTuple):
     """
-    Metadata endpoint and well known URL handler
-    GET /metadata
-    GET /.well-known/oauth-authorization-server
+    A pre-encoded metadata response body and its strong ETag
+    """
+
+    body: bytes
+    etag: str
+
+
+def encode_metadata(request: Request) -> EncodedMetadata:
     """
+    Build and encode the metadata for the request's base URL
+    """
+
+    import indieweb_utils    # pylint: disable=import-outside-toplevel
 
     body = {
         'issuer': str(request.url_for('get_authorize')),
@@ -29,4 +48,59 @@ async def metadata_handler(request: Request) -> JSONResponse:
         'code_challenge_methods_supported': ['S256']
     }
 
-    return JSONResponse(status_code=HTTPStatus.OK, content=body)
+    encoded = JSONResponse(content=body).body
+    return EncodedMetadata(encoded, f'"{hashlib.sha256(encoded).hexdigest()[:32]}"')
+
+
+@lru_cache
+def get_metadata_cache() -> LRUCache[str, EncodedMetadata]:
+    """
+    Get this worker's cache of encoded metadata, keyed by base URL
+    """
+
+    return LRUCache(METADATA_CACHE_SIZE)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Does an If-None-Match header match an ETag, using the weak comparison RFC 9110 requires?
+    """
+
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+async def metadata_handler(request: Request) -> Response:
+    """
+    Metadata endpoint and well known URL handler
+    GET /metadata
+    GET /.well-known/oauth-authorization-server
+    """
+
+    cache = get_metadata_cache()
+    key = str(request.base_url)
+    metadata = cache.get(key)
+    record_cache('metadata', 'miss' if metadata is None else 'hit')
+    if metadata is None:
+        metadata = encode_metadata(request)
+        cache.set(key, metadata)
+
+    headers = {
+        'ETag': metadata.etag,
+        'Cache-Control': f'public, max-age={get_settings().metadata_max_age:d}'
+    }
+
+    if etag_matches(request.headers.get('if-none-match'), metadata.etag):
+        return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+
+    return Response(
+        status_code=HTTPStatus.OK,
+        content=metadata.body,
+        media_type='application/json',
+        headers=headers
+    )
@@ -0,0 +1,28 @@
+"""
+IndieAuthify: methods package; metrics method handler module
+"""
+
+from http import HTTPStatus
+
+from fastapi.requests import Request
+from fastapi.responses import Response
+
+from indieauthify_server.common.metrics import render_metrics
+from indieauthify_server.common.responses import JSONResponse
+from indieauthify_server.common.tokens import has_api_key
+
+
+async def metrics_handler(request: Request) -> Response:
+    """
+    Prometheus metrics handler; the scraper must send the API key as a Bearer token
+    GET /metrics
+    """
+
+    if not has_api_key(request.headers.get('authorization', '')):
+        return JSONResponse(
+            status_code=HTTPStatus.UNAUTHORIZED,
+            content={'error': 'invalid_token'},
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
+
+    return render_metrics()
@@ -0,0 +1,60 @@
+"""
+IndieAuthify: methods package; bulk revocation method handler module
+"""
+
+from http import HTTPStatus
+
+from fastapi.requests import Request
+
+from indieauthify_server.common.responses import JSONResponse
+from indieauthify_server.common.tokens import get_claims_cache, has_api_key, parse_token_id, token_expiry
+from indieauthify_server.common.tracing import span
+from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.dependencies.tokenstore import TokenStore
+from indieauthify_server.models import RevokeParams
+
+
+async def bulk_revoke_handler(request: Request, params: RevokeParams, store: TokenStore) -> JSONResponse:
+    """
+    Bulk revocation handler; revokes the tokens listed, as tokens or hex encoded
+    digests, and every issued token matching all of client_id, me and issued_before
+    POST /revoke
+    """
+
+    settings = get_settings()
+    if not has_api_key(request.headers.get('authorization', '')):
+        return JSONResponse(
+            status_code=HTTPStatus.UNAUTHORIZED,
+            content={'error': 'invalid_token'},
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
+
+    if not params.tokens and params.client_id is None and params.me is None and params.issued_before is None:
+        return JSONResponse(
+            status_code=HTTPStatus.BAD_REQUEST,
+            content={'error': 'invalid_request'}
+        )
+
+    tokens = [(parse_token_id(token), token_expiry(token, settings.session_key)) for token in params.tokens]
+
+    # issued tokens' created times are naive local times
+    created_before = None
+    if params.issued_before is not None:
+        created_before = params.issued_before.astimezone().strftime('%Y-%m-%d %H:%M:%S')
+
+    with span('revoke.bulk', tokens=len(tokens), client_id=params.client_id, me=params.me) as revoke_span:
+        revoked, added, deleted = await store.revoke_tokens(tokens, params.client_id, params.me, created_before)
+        revoke_span.set_attribute('revoked', len(revoked))
+
+    claims_cache = get_claims_cache()
+    for token_hash in revoked:
+        claims_cache.pop(token_hash)
+
+    return JSONResponse(
+        status_code=HTTPStatus.OK,
+        content={
+            'revoked': added,
+            'already_revoked': len(revoked) - added,
+            'issued_deleted': deleted
+        }
+    )
@@ -3,31 +3,40 @@ IndieAuthify: methods package; token methods handler module
 """
 
 import logging
-from dataclasses import asdict
 import datetime
 from http import HTTPStatus
 import json
 import secrets
-import sqlite3
 import time
 
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse, RedirectResponse, Response
-import indieweb_utils
-import jwt
-import requests
-
-from indieauthify_server.dependencies.settings import get_settings
+from fastapi.responses import RedirectResponse, Response
+import httpx
+
+from indieauthify_server.common.client import InvalidClientId, get_client_metadata_cache
+from indieauthify_server.common.metrics import record_cache
+from indieauthify_server.common.profile import get_profile_cache
+from indieauthify_server.common.responses import JSONResponse
+from indieauthify_server.common.tokens import get_claims_cache, strip_bearer, token_digest, token_expiry
+from indieauthify_server.common.tracing import span
+from indieauthify_server.common.webhooks import get_webhook_queue
 from indieauthify_server.dependencies.flash import flash_message
+from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.dependencies.tokenstore import TokenStore
 from indieauthify_server.models import TokenParams
 
 
-async def token_handler(request: Request) -> JSONResponse:    # pylint: disable=too-many-return-statements
+async def token_handler(    # pylint: disable=too-many-return-statements
+    request: Request,
+    store: TokenStore
+) -> JSONResponse:
     """
     Token handler
     GET /token
     """
 
+    import jwt    # pylint: disable=import-outside-toplevel
+
     authorization = request.headers.get('authorization')
 
     if not authorization:
@@ -37,40 +46,38 @@ async def token_handler(request: Request) -> JSONResponse:    # pylint: disable=
         )
 
     settings = get_settings()
-    connection = sqlite3.connect(settings.token_db_path)
-
-    with connection:
-        cursor = connection.cursor()
+    authorization = strip_bearer(authorization)
+    token_hash = token_digest(authorization)
+    if await store.is_revoked(token_hash):
+        return JSONResponse(
+            status_code=HTTPStatus.BAD_REQUEST,
+            content={'error': 'invalid_grant'}
+        )
 
-        is_revoked = cursor.execute(
-            "SELECT * FROM revoked_tokens WHERE token = ?",
-            (authorization,
+    now = int(time.time())
+    claims_cache = get_claims_cache()
+    decoded_authorization_code = claims_cache.get(token_hash)
+    record_cache('claims', 'miss' if decoded_authorization_code is None else 'hit')
+    if decoded_authorization_code is None:
+        try:
+            decoded_authorization_code = jwt.decode(
+                authorization,
+                settings.session_key,
+                algorithms=['HS256']
             )
-        ).fetchone()
-
-        if is_revoked:
+        except jwt.DecodeError as exc:
             return JSONResponse(
                 status_code=HTTPStatus.BAD_REQUEST,
-                content={'error': 'invalid_grant'}
+                content={
+                    'error': 'invalid_code',
+                    'details': exc
+                }
             )
 
-    authorization = authorization.replace('Bearer ', '')
-    try:
-        decoded_authorization_code = jwt.decode(
-            authorization,
-            settings.session_key,
-            algorithms=['HS256']
-        )
-    except jwt.DecodeError as exc:
-        return JSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={
-                'error': 'invalid_code',
-                'details': exc
-            }
-        )
+        if now < decoded_authorization_code['expires']:
+            claims_cache.set(token_hash, decoded_authorization_code, ttl=decoded_authorization_code['expires'] - now)
 
-    if int(time.time()) > decoded_authorization_code['expires']:
+    if now > decoded_authorization_code['expires']:
         return JSONResponse(
             status_code=HTTPStatus.BAD_REQUEST,
             content={'error': 'invalid_grant'}
@@ -89,14 +96,14 @@ async def token_handler(request: Request) -> JSONResponse:    # pylint: disable=
             )
 
     if 'profile' in scope:
-        parsed_profile = indieweb_utils.get_profile(me)
+        profile = await get_profile_cache().get(me)
 
-        if parsed_profile:
+        if profile:
             content = {
                 'me': me.strip('/') + '/',
                 'client_id': client_id,
                 'scope': scope,
-                'profile': asdict(parsed_profile),
+                'profile': profile,
             }
             return JSONResponse(status_code=HTTPStatus.OK, content=content)
 
@@ -110,21 +117,22 @@ async def token_handler(request: Request) -> JSONResponse:    # pylint: disable=
 
 async def token_form_handler(   # pylint: disable=too-many-arguments
     request: Request,
-    params: TokenParams
+    params: TokenParams,
+    store: TokenStore
 ) -> JSONResponse:
     """
     Token form handler
     POST /token
     """
 
+    import indieweb_utils    # pylint: disable=import-outside-toplevel
+
     settings = get_settings()
     if params.action and params.action == 'revoke':
-        connection = sqlite3.connect(settings.token_db_path)
-
-        with connection:
-            cursor = connection.cursor()
-
-            cursor.execute("INSERT INTO revoked_tokens VALUES (?)", (params.code,))
+        with span('token.revoke'):
+            token_hash = token_digest(params.code)
+            await store.revoke_token(token_hash, token_expiry(params.code, settings.session_key))
+            get_claims_cache().pop(token_hash)
 
         return JSONResponse(
             status_code=HTTPStatus.OK,
@@ -134,50 +142,45 @@ async def token_form_handler(   # pylint: disable=too-many-arguments
     if params.grant_type == 'authorization_code':
         access = 'all'
     else:
-        db = sqlite3.connect(settings.token_db_path)
+        with span('token.ticket'):
+            ticket = await store.get_ticket(token_digest(params.code))
 
-        with db:
-            cursor = db.cursor()
-
-            ticket = cursor.execute("SELECT * FROM tickets WHERE token = ?",
-                                    (params.code,
-                                    )).fetchone()
-
-            if not ticket:
-                return JSONResponse(
-                    status_code=HTTPStatus.BAD_REQUEST,
-                    content={'error': 'invalid_ticket'}
-                )
+        if not ticket:
+            return JSONResponse(
+                status_code=HTTPStatus.BAD_REQUEST,
+                content={'error': 'invalid_ticket'}
+            )
 
-            access = ticket[1]
+        access = ticket[1]
 
     settings = get_settings()
-    try:
-        redeem_code = indieweb_utils.redeem_code(
-            params.grant_type,
-            params.code,
-            params.client_id,
-            params.redirect_uri,
-            params.code_verifier,
-            settings.session_key,
-            resource=access,
-        )
+    with span('token.redeem_code', grant_type=params.grant_type, client_id=params.client_id):
+        try:
+            redeem_code = indieweb_utils.redeem_code(
+                params.grant_type,
+                params.code,
+                params.client_id,
+                params.redirect_uri,
+                params.code_verifier,
+                settings.session_key,
+                resource=access,
+            )
 
-        access_token = redeem_code.access_token
-        scope = redeem_code.scope
-        me = redeem_code.me    # pylint: disable=invalid-name
-    except (
-        indieweb_utils.indieauth.server.AuthenticationError,
-        indieweb_utils.indieauth.server.AuthorizationCodeExpiredError,
-        indieweb_utils.indieauth.server.TokenValidationError
-    ) as exc:
-        return JSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={
-                'error': 'invalid_request',
-                'details': exc
-            }
-        )
+            access_token = redeem_code.access_token
+            scope = redeem_code.scope
+            me = redeem_code.me    # pylint: disable=invalid-name
+        except (
+            indieweb_utils.indieauth.server.AuthenticationError,
+            indieweb_utils.indieauth.server.AuthorizationCodeExpiredError,
+            indieweb_utils.indieauth.server.TokenValidationError
+        ) as exc:
+            return JSONResponse(
+                status_code=HTTPStatus.BAD_REQUEST,
+                content={
+                    'error': 'invalid_request',
+                    'details': exc
+                }
+            )
 
     content = {
         'access_token': access_token,
@@ -188,8 +191,9 @@ async def token_form_handler(   # pylint: disable=too-many-arguments
     return JSONResponse(status_code=HTTPStatus.OK, content=content)
 
 
-async def generate_token_handler(
+async def generate_token_handler(    # pylint: disable=too-many-arguments
     request: Request,
+    store: TokenStore,
     me: str,
     client_id: str,
     redirect_uri: str,
@@ -204,6 +208,8 @@ async def generate_token_handler(
     POST /generate
     """
 
+    import indieweb_utils    # pylint: disable=import-outside-toplevel
+
     logging.debug('generate_token_handler')
     if not request.session.get("logged_in"):
         return RedirectResponse(url=request.url_for('get_login_page',
@@ -218,62 +224,45 @@ async def generate_token_handler(
         state = secrets.token_urlsafe(32)
 
     settings = get_settings()
-    try:
-        response = indieweb_utils.generate_auth_token(
-            me,
-            client_id,
-            redirect_uri,
-            response_type,
-            state,
-            code_challenge_method,
-            final_scope,
-            settings.session_key,
-        )
-
-        encoded_code = response.code
-    except indieweb_utils.indieauth.server.AuthenticationError as exc:
-        return JSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={
-                'error': 'invalid_request',
-                'details': exc
-            }
-        )
-
-    try:
-        client_id_app = requests.get(client_id, timeout=5)
-        h_app_item = indieweb_utils.get_h_app_item(client_id_app.text)
-    except indieweb_utils.indieauth.happ.HAppNotFound:
-        h_app_item = {}
-
-    connection = sqlite3.connect(settings.token_db_path)
-
-    with connection:
-        cursor = connection.cursor()
-
-        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with span('generate.auth_token', me=me, client_id=client_id, response_type=response_type):
+        try:
+            response = indieweb_utils.generate_auth_token(
+                me,
+                client_id,
+                redirect_uri,
+                response_type,
+                state,
+                code_challenge_method,
+                final_scope,
+                settings.session_key,
+            )
 
-        already_issued_to_client = cursor.execute(
-            "SELECT * FROM issued_tokens WHERE client_id = ?",
-            (client_id,
+            encoded_code = response.code
+        except indieweb_utils.indieauth.server.AuthenticationError as exc:
+            return JSONResponse(
+                status_code=HTTPStatus.BAD_REQUEST,
+                content={
+                    'error': 'invalid_request',
+                    'details': exc
+                }
             )
-        ).fetchall()
 
-        # delete tokens that have already been issued to the client
-        # ensures that more than one token cannot be active per client
-        if len(already_issued_to_client) > 0:
-            cursor.execute("DELETE FROM issued_tokens WHERE client_id = ?", (client_id,))
+    with span('generate.client_metadata', client_id=client_id):
+        try:
+            client = await get_client_metadata_cache().get(client_id)
+            h_app_item = client.h_app_item or {}
+        except (InvalidClientId, httpx.HTTPError):
+            h_app_item = {}
 
-        cursor.execute(
-            "INSERT INTO issued_tokens VALUES (?, ?, ?, ?, ?, ?)",
-            (
-                encoded_code,
-                me,
-                now,
-                client_id,
-                int(time.time()) + 3600,
-                json.dumps(asdict(h_app_item)),
-            ),
+    with span('generate.store_token'):
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        await store.replace_issued_token(
+            token_digest(encoded_code),
+            me,
+            now,
+            client_id,
+            int(time.time()) + 3600,
+            json.dumps(h_app_item),
         )
 
     if is_manually_issued and is_manually_issued == "true":
@@ -289,15 +278,7 @@ async def generate_token_handler(
             "message": f"{me} has issued an access token to {client_id}"
         }
 
-        headers = {
-            "Authorization": f"Bearer {settings.webhook_api_key}"
-        }
-
-        requests.post(
-            settings.webhook_url,
-            data=data,
-            headers=headers,
-            timeout=settings.rpc_timeout
-        )
+        with span('generate.enqueue_webhook'):
+            await get_webhook_queue().enqueue(settings.webhook_url, data)
 
     return RedirectResponse(url=redirect_uri.strip("/") + f"?code={encoded_code}&state={state}")
@@ -0,0 +1,303 @@
+"""
+IndieAuthify: token database schema migrations module
+
+The schema version is held in the database's PRAGMA user_version and each
+migration is applied, in order, in its own IMMEDIATE transaction so that
+gunicorn workers starting at the same time apply each migration just once.
+
+    python -m indieauthify_server.migrations
+"""
+
+import logging
+import sqlite3
+from typing import List, NamedTuple
+
+from indieauthify_server.common.tokens import strip_bearer, token_digest
+from indieauthify_server.dependencies.settings import get_settings
+
+
+class Migration(NamedTuple):
+    """
+    A single, versioned schema migration
+    """
+
+    version: int
+    description: str
+    statements: List[str]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1,
+        'baseline schema',
+        [
+            """
+            CREATE TABLE IF NOT EXISTS issued_tokens (
+                token text,
+                me text,
+                created text,
+                client_id text,
+                expires int,
+                app_item text
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                token text
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS tickets (
+                token text,
+                resource text,
+                expires int
+            )
+            """,
+        ]
+    ),
+    Migration(
+        2,
+        'primary keys and indexes',
+        [
+            """
+            CREATE TABLE issued_tokens_v2 (
+                token TEXT PRIMARY KEY NOT NULL,
+                me TEXT NOT NULL,
+                created TEXT NOT NULL,
+                client_id TEXT NOT NULL,
+                expires INTEGER NOT NULL,
+                app_item TEXT
+            )
+            """,
+            'INSERT OR IGNORE INTO issued_tokens_v2 SELECT * FROM issued_tokens WHERE token IS NOT NULL ORDER BY rowid',
+            'DROP TABLE issued_tokens',
+            'ALTER TABLE issued_tokens_v2 RENAME TO issued_tokens',
+            'CREATE INDEX issued_tokens_client_id ON issued_tokens (client_id)',
+            'CREATE INDEX issued_tokens_expires ON issued_tokens (expires)',
+            # AUTOINCREMENT keeps rowids monotonic, which the revocation filter relies
+            # on to load only the tokens revoked since it was last synced
+            """
+            CREATE TABLE revoked_tokens_v2 (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                token TEXT NOT NULL UNIQUE
+            )
+            """,
+            """
+            INSERT OR IGNORE INTO revoked_tokens_v2 (token)
+            SELECT token FROM revoked_tokens WHERE token IS NOT NULL ORDER BY rowid
+            """,
+            'DROP TABLE revoked_tokens',
+            'ALTER TABLE revoked_tokens_v2 RENAME TO revoked_tokens',
+            """
+            CREATE TABLE tickets_v2 (
+                token TEXT PRIMARY KEY NOT NULL,
+                resource TEXT NOT NULL,
+                expires INTEGER
+            )
+            """,
+            'INSERT OR IGNORE INTO tickets_v2 SELECT * FROM tickets WHERE token IS NOT NULL ORDER BY rowid',
+            'DROP TABLE tickets',
+            'ALTER TABLE tickets_v2 RENAME TO tickets',
+            'CREATE INDEX tickets_expires ON tickets (expires)',
+        ]
+    ),
+    Migration(
+        3,
+        'key tokens by SHA-256 digest',
+        [
+            """
+            CREATE TABLE issued_tokens_v3 (
+                token_hash BLOB PRIMARY KEY NOT NULL,
+                me TEXT NOT NULL,
+                created TEXT NOT NULL,
+                client_id TEXT NOT NULL,
+                expires INTEGER NOT NULL,
+                app_item TEXT
+            )
+            """,
+            """
+            INSERT OR IGNORE INTO issued_tokens_v3
+            SELECT token_digest(token), me, created, client_id, expires, app_item FROM issued_tokens ORDER BY rowid
+            """,
+            'DROP TABLE issued_tokens',
+            'ALTER TABLE issued_tokens_v3 RENAME TO issued_tokens',
+            'CREATE INDEX issued_tokens_client_id ON issued_tokens (client_id)',
+            'CREATE INDEX issued_tokens_expires ON issued_tokens (expires)',
+            """
+            CREATE TABLE revoked_tokens_v3 (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                token_hash BLOB NOT NULL UNIQUE
+            )
+            """,
+            """
+            INSERT OR IGNORE INTO revoked_tokens_v3 (id, token_hash)
+            SELECT id, token_digest(token) FROM revoked_tokens ORDER BY id
+            """,
+            'DROP TABLE revoked_tokens',
+            'ALTER TABLE revoked_tokens_v3 RENAME TO revoked_tokens',
+            """
+            CREATE TABLE tickets_v3 (
+                token_hash BLOB PRIMARY KEY NOT NULL,
+                resource TEXT NOT NULL,
+                expires INTEGER
+            )
+            """,
+            """
+            INSERT OR IGNORE INTO tickets_v3
+            SELECT token_digest(token), resource, expires FROM tickets ORDER BY rowid
+            """,
+            'DROP TABLE tickets',
+            'ALTER TABLE tickets_v3 RENAME TO tickets',
+            'CREATE INDEX tickets_expires ON tickets (expires)',
+        ]
+    ),
+    Migration(
+        4,
+        'expiry for revoked tokens',
+        [
+            # NULL for tokens revoked before expiry was recorded, which are never compacted
+            'ALTER TABLE revoked_tokens ADD COLUMN expires INTEGER',
+            'CREATE INDEX revoked_tokens_expires ON revoked_tokens (expires)',
+        ]
+    ),
+    Migration(
+        5,
+        'issued tokens by creation time',
+        [
+            # every index ends with the rowid, so this serves the (created, rowid) keyset
+            'CREATE INDEX issued_tokens_created ON issued_tokens (created)',
+        ]
+    ),
+    Migration(
+        6,
+        'server-side sessions',
+        [
+            """
+            CREATE TABLE sessions (
+                session_hash BLOB PRIMARY KEY NOT NULL,
+                data TEXT NOT NULL,
+                expires INTEGER NOT NULL
+            )
+            """,
+            'CREATE INDEX sessions_expires ON sessions (expires)',
+        ]
+    ),
+    Migration(
+        7,
+        'webhook delivery queue',
+        [
+            """
+            CREATE TABLE webhook_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                claimed_until REAL,
+                last_error TEXT
+            )
+            """,
+            'CREATE INDEX webhook_queue_next_attempt ON webhook_queue (next_attempt)',
+            """
+            CREATE TABLE webhook_dead_letters (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                failed REAL NOT NULL,
+                last_error TEXT
+            )
+            """,
+        ]
+    ),
+    Migration(
+        8,
+        'leases',
+        [
+            """
+            CREATE TABLE leases (
+                name TEXT PRIMARY KEY NOT NULL,
+                holder TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+            """,
+        ]
+    ),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(connection: sqlite3.Connection) -> int:
+    """
+    Get the database's current schema version
+    """
+
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(connection: sqlite3.Connection, target: int = SCHEMA_VERSION) -> int:
+    """
+    Apply any pending migrations up to the target version, returning the resulting schema version
+    """
+
+    if get_schema_version(connection) >= target:
+        return get_schema_version(connection)
+
+    # revocations used to store the Authorization header as sent, so strip
+    # the Bearer scheme and whitespace before hashing a legacy token
+    connection.create_function(
+        'token_digest',
+        1,
+        lambda token: token_digest(strip_bearer(token)) if token is not None else None,
+        deterministic=True
+    )
+
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    try:
+        for migration in MIGRATIONS:
+            if migration.version > target:
+                break
+
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if get_schema_version(connection) >= migration.version:
+                    connection.execute('COMMIT')
+                    continue
+
+                logging.info('applying token database migration %d: %s', migration.version, migration.description)
+                for statement in migration.statements:
+                    connection.execute(statement)
+
+                connection.execute(f'PRAGMA user_version = {migration.version:d}')
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+    finally:
+        connection.isolation_level = isolation_level
+
+    return get_schema_version(connection)
+
+
+def main() -> None:
+    """
+    Migrate the configured token database to the current schema version
+    """
+
+    logging.basicConfig(level=logging.INFO)
+    settings = get_settings()
+    with sqlite3.connect(settings.token_db_path) as connection:
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.execute('PRAGMA journal_mode = WAL')
+        version = migrate(connection)
+
+    connection.close()
+    logging.info('%s is at schema version %d', settings.token_db_path, version)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@
 IndieAuthify: models module
 """
 
-from typing import Annotated
+import datetime
+from typing import Annotated, List
 
 from fastapi import Form
 from pydantic import BaseModel
@@ -51,3 +52,14 @@ class TokenParams(BaseModel):
     client_id: Annotated[str, Form()]
     redirect_uri: Annotated[str, Form()]
     code_verifier: Annotated[str, Form()]
+
+
+class RevokeParams(BaseModel):
+    """
+    POST /revoke body parameters
+    """
+
+    tokens: List[str] = []
+    client_id: str | None = None
+    me: str | None = None    # pylint: disable=invalid-name
+    issued_before: datetime.datetime | None = None
@@ -4,49 +4,69 @@ IndieAuthify: pages package; issued tokens page module
 
 from http import HTTPStatus
 import json
-import sqlite3
+from typing import Optional, Tuple
 
 from fastapi import HTTPException
 from fastapi.requests import Request
 from fastapi.responses import RedirectResponse, Response
-import indieweb_utils
 
+from indieauthify_server.common.tokens import parse_token_id
+from indieauthify_server.dependencies.flash import get_flash_messages
 from indieauthify_server.dependencies.settings import get_settings
-from indieauthify_server.dependencies.templates import get_template_engine
+from indieauthify_server.dependencies.templates import get_template_engine, stream_template
+from indieauthify_server.dependencies.tokenstore import TokenStore
 
 
-async def render_issued_page(
+def encode_cursor(row: tuple) -> str:
+    """
+    Encode the (created, rowid) keyset of an issued tokens page row as a page cursor
+    """
+
+    return f'{row[6]}:{row[2]}'
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Decode a page cursor into its (created, rowid) keyset
+    """
+
+    rowid, _, created = cursor.partition(':')
+    try:
+        return created, int(rowid)
+    except ValueError as exc:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail='Invalid page cursor') from exc
+
+
+async def render_issued_page(    # pylint: disable=too-many-arguments
     request: Request,
+    store: TokenStore,
     feed: str = 'false',
     authorization: str | None = None,
-    token: str | None = None
+    token: str | None = None,
+    before: str | None = None,
+    limit: int | None = None
 ) -> Response:
     """
     Render the issues and issue detail page
     GET /issued
     """
 
+    import indieweb_utils    # pylint: disable=import-outside-toplevel
+
     settings = get_settings()
     if token:
-        connection = sqlite3.connect(settings.token_db_path)
-
-        with connection:
-            cursor = connection.cursor()
-
-            issued_tokens = cursor.execute('SELECT * FROM issued_tokens WHERE token = ?',
-                                           (token,
-                                           )).fetchone()
+        issued_token = await store.get_issued_token(parse_token_id(token))
 
-            if len(issued_tokens) == 0:
-                raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='No tokens found')
+        if not issued_token:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='No tokens found')
 
-        token_app = json.loads(issued_tokens[5])
+        token_app = json.loads(issued_token[5])
 
         args = {
             'request': request,
             'title': 'About an Issued Token',
             'token_app': token_app,
-            'token': issued_tokens,
+            'token': issued_token,
             'SCOPE_DEFINITIONS': indieweb_utils.SCOPE_DEFINITIONS
         }
         return get_template_engine().TemplateResponse('single_token.html.j2', args)
@@ -54,22 +74,33 @@ async def render_issued_page(
     if not request.session.get("logged_in") and authorization != settings.api_key:
         return RedirectResponse(url=request.url_for('get_login_page'))
 
-    connection = sqlite3.connect(settings.token_db_path)
-
-    with connection:
-        cursor = connection.cursor()
+    if feed == 'true':
+        # the session cookie is sent before the body is streamed, so take the
+        # flash messages out of the session now rather than while rendering
+        get_flash_messages(request)
+        args = {
+            'request': request,
+            'title': 'Issued Token',
+            'issued_tokens': store.iter_issued_tokens(),
+            'SCOPE_DEFINITIONS': indieweb_utils.SCOPE_DEFINITIONS
+        }
+        return stream_template('issued_feed.html.j2', args)
 
-        issued_tokens = cursor.execute('SELECT * FROM issued_tokens').fetchall()
+    page_size = min(max(limit or settings.issued_page_size, 1), settings.issued_max_page_size)
+    keyset: Optional[Tuple[str, int]] = decode_cursor(before) if before else None
+    issued_tokens = await store.get_issued_tokens(page_size + 1, keyset)
 
-    if feed == 'true':
-        template = 'issued_feed.html.j2'
-    else:
-        template = 'issued.html.j2'
+    next_url = None
+    if len(issued_tokens) > page_size:
+        issued_tokens = issued_tokens[:page_size]
+        next_url = str(request.url.include_query_params(before=encode_cursor(issued_tokens[-1]), limit=page_size))
 
     args = {
         'request': request,
         'title': 'Issued Token',
         'issued_tokens': issued_tokens,
+        'next_url': next_url,
+        'is_first_page': keyset is None,
         'SCOPE_DEFINITIONS': indieweb_utils.SCOPE_DEFINITIONS
     }
-    return get_template_engine().TemplateResponse(name=template, context=args)
+    return get_template_engine().TemplateResponse(name='issued.html.j2', context=args)
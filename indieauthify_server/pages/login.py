@@ -6,11 +6,12 @@ from http import HTTPStatus
 import logging
 
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse, RedirectResponse, Response
+from fastapi.responses import RedirectResponse, Response
 from pydantic import HttpUrl
 from pydantic.tools import parse_obj_as
 
 from indieauthify_server.common.relme import get_relme_links
+from indieauthify_server.common.responses import JSONResponse
 from indieauthify_server.common.url import normalise_url
 from indieauthify_server.dependencies.settings import get_settings
 from indieauthify_server.dependencies.templates import get_template_engine
@@ -120,7 +121,7 @@ async def render_rel_page(request: Request) -> Response:
 
     relme_uri = parse_obj_as(HttpUrl, request.session.get('rel_me_check'))
     logging.debug('getting rel=me links for %s', relme_uri)
-    rel_me_links = get_relme_links(relme_uri, require_link_back=True)
+    rel_me_links = await get_relme_links(relme_uri, require_link_back=True)
     logging.debug('received rel=me links: %s', rel_me_links)
     settings = get_settings()
     args = {
@@ -6,13 +6,15 @@ from http import HTTPStatus
 import sqlite3
 
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse, RedirectResponse, Response
+from fastapi.responses import RedirectResponse, Response
 
-from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.common.responses import JSONResponse
+from indieauthify_server.common.tokens import parse_token_id
 from indieauthify_server.dependencies.flash import flash_message
+from indieauthify_server.dependencies.tokenstore import TokenStore
 
 
-async def render_revoke_page(request: Request, token: str | None = None) -> Response:
+async def render_revoke_page(request: Request, store: TokenStore, token: str | None = None) -> Response:
     """
     Render the revoke token page
     GET /revoke
@@ -25,17 +27,8 @@ async def render_revoke_page(request: Request, token: str | None = None) -> Resp
         )
 
     try:
-        settings = get_settings()
-        connection = sqlite3.connect(settings.token_db_path)
-
-        with connection:
-            cursor = connection.cursor()
-            if token == 'all':
-                cursor.execute("DELETE FROM issued_tokens")
-            else:
-                cursor.execute("DELETE FROM issued_tokens WHERE token = ?", (token,))
-
-            flash_message(request, 'Your token was revoked', 'success')
+        await store.delete_issued_token(None if token == 'all' else parse_token_id(token))
+        flash_message(request, 'Your token was revoked', 'success')
 
     except sqlite3.Error as exc:
         flash_message(request, f'There was an error revoking your token: {exc}', 'error')
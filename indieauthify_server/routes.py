@@ -5,14 +5,17 @@ IndieAuthify: routes module
 import logging
 from typing import Annotated, Union
 
-from fastapi import APIRouter, Form, Query
+from fastapi import APIRouter, Depends, Form, Query
 from fastapi.requests import Request
 from fastapi.responses import Response
 
-from indieauthify_server.models import AuthorizeParams, TokenParams
+from indieauthify_server.dependencies.tokenstore import TokenStore, get_token_store
+from indieauthify_server.models import AuthorizeParams, RevokeParams, TokenParams
 from indieauthify_server.methods.authorize import authorize_handler
 from indieauthify_server.methods.github import github_authenticate_handler, github_login_handler
 from indieauthify_server.methods.metadata import metadata_handler
+from indieauthify_server.methods.metrics import metrics_handler
+from indieauthify_server.methods.revoke import bulk_revoke_handler
 from indieauthify_server.methods.token import generate_token_handler, token_form_handler, token_handler
 from indieauthify_server.pages.home import render_home_page
 from indieauthify_server.pages.issued import render_issued_page
@@ -138,6 +141,15 @@ async def metadata(request: Request) -> Response:
     return await metadata_handler(request)
 
 
+@router.get('/metrics')
+async def metrics(request: Request) -> Response:
+    """
+    Obtain Prometheus metrics
+    """
+
+    return await metrics_handler(request)
+
+
 @router.get('/.well-known/oauth-authorization-server')
 async def oauth_authorization_server(request: Request) -> Response:
     """
@@ -149,23 +161,27 @@ async def oauth_authorization_server(request: Request) -> Response:
 
 
 @router.get('/issued')
-async def issued_page(
+async def issued_page(    # pylint: disable=too-many-arguments
     request: Request,
+    store: Annotated[TokenStore, Depends(get_token_store)],
     feed: str = 'false',
     authorization: str | None = None,
-    token: str | None = None
+    token: str | None = None,
+    before: str | None = None,
+    limit: int | None = None
 ) -> Response:
     """
     View issued tokens
     """
 
     logging.debug('%s %s', request.method, request.url.path)
-    return await render_issued_page(request, feed, authorization, token)
+    return await render_issued_page(request, store, feed, authorization, token, before, limit)
 
 
 @router.post('/generate')
 async def generate_token(     # pylint: disable=too-many-arguments
     request: Request,
+    store: Annotated[TokenStore, Depends(get_token_store)],
     me: Annotated[str, Form()],    # pylint: disable=invalid-name
     client_id: Annotated[str, Form()],
     redirect_uri: Annotated[str, Form()],
@@ -182,6 +198,7 @@ async def generate_token(     # pylint: disable=too-many-arguments
     logging.debug('%s %s', request.method, request.url.path)
     return await generate_token_handler(
         request,
+        store,
         me,
         client_id,
         redirect_uri,
@@ -194,33 +211,55 @@ async def generate_token(     # pylint: disable=too-many-arguments
 
 
 @router.get('/revoke')
-async def revoke_token(request: Request, token: str | None = None) -> Response:
+async def revoke_token(
+    request: Request,
+    store: Annotated[TokenStore, Depends(get_token_store)],
+    token: str | None = None
+) -> Response:
     """
     Revoke token
     """
 
     logging.debug('%s %s', request.method, request.url.path)
-    return await render_revoke_page(request, token)
+    return await render_revoke_page(request, store, token)
+
+
+@router.post('/revoke')
+async def bulk_revoke_tokens(
+    request: Request,
+    params: RevokeParams,
+    store: Annotated[TokenStore, Depends(get_token_store)]
+) -> Response:
+    """
+    Revoke tokens in bulk
+    """
+
+    logging.debug('%s %s', request.method, request.url.path)
+    return await bulk_revoke_handler(request, params, store)
 
 
 @router.get('/token')
-async def get_token_endpoint(request: Request) -> Response:
+async def get_token_endpoint(
+    request: Request,
+    store: Annotated[TokenStore, Depends(get_token_store)]
+) -> Response:
     """
     Issue token via GET
     """
 
     logging.debug('%s %s', request.method, request.url.path)
-    return await token_handler(request)
+    return await token_handler(request, store)
 
 
 @router.post('/token')
 async def post_token_endpoint(     # pylint: disable=too-many-arguments
     request: Request,
-    params: TokenParams
+    params: TokenParams,
+    store: Annotated[TokenStore, Depends(get_token_store)]
 ) -> Response:
     """
     Issue token via POST
     """
 
     logging.debug('%s %s', request.method, request.url.path)
-    return await token_form_handler(request=request, params=params)
+    return await token_form_handler(request=request, params=params, store=store)
@@ -2,23 +2,43 @@
 IndieAuthify: main server module
 """
 
+from functools import _lru_cache_wrapper
+from http import HTTPStatus
+import importlib
 import logging
 import os
 from pathlib import Path
+from typing import Any, Tuple
 
 from fastapi import FastAPI
 from fastapi.logger import logger as fastapi_logger
+from fastapi.requests import Request
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware.sessions import SessionMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
+from indieauthify_server.common.client import get_client_metadata_cache
+from indieauthify_server.common.metrics import MetricsMiddleware
+from indieauthify_server.common.profile import get_profile_cache
+from indieauthify_server.common.relme import get_relme_cache
+from indieauthify_server.common.responses import JSONResponse
+from indieauthify_server.common.tracing import TraceFormatter, TracingMiddleware, get_tracer, install_log_record_factory
+from indieauthify_server.common.webhooks import get_webhook_queue
+from indieauthify_server.compaction import get_compactor
+from indieauthify_server.dependencies.http import close_http_client, discard_http_client, open_http_client
+from indieauthify_server.dependencies.sessions import ServerSessionMiddleware, get_session_backend
 from indieauthify_server.dependencies.settings import get_settings
+from indieauthify_server.dependencies.templates import warm_templates
+from indieauthify_server.dependencies.tokenstore import TokenStoreBusy, get_token_store
+from indieauthify_server.importtime import DEFERRED_IMPORTS
 from indieauthify_server.routes import router
 
 STATIC_DIR = 'static'
 APP_ROOT = Path(__file__).parents[1]
 STATIC_ROOT = str(APP_ROOT / STATIC_DIR)
 
+# Paths whose handlers never use the session, so it isn't loaded for them
+SESSIONLESS_PATHS = ('/static/', '/metrics', '/metadata', '/.well-known/', '/token')
+
 settings = get_settings()
 debug = settings.app_env.lower() != 'production'
 
@@ -45,8 +65,105 @@ if 'gunicorn' in os.environ.get('SERVER_SOFTWARE', ''):
     uvicorn_access_logger.setLevel(log_level)
     fastapi_logger.setLevel(log_level)
 
-app = FastAPI(debug=debug, title='IndieAuthify')
-app.add_middleware(SessionMiddleware, secret_key=settings.session_key)
+# Tag every log record with the current trace and span IDs, and append them to the log lines
+install_log_record_factory()
+for handler in {*logging.getLogger().handlers, *logging.getLogger('uvicorn.access').handlers, *fastapi_logger.handlers}:
+    if not isinstance(handler.formatter, TraceFormatter):
+        handler.setFormatter(TraceFormatter(handler.formatter))
+
+app = FastAPI(debug=debug, title='IndieAuthify', default_response_class=JSONResponse)
+app.add_middleware(
+    ServerSessionMiddleware,
+    secret_key=settings.session_key,
+    max_age=settings.session_max_age,
+    exclude_paths=SESSIONLESS_PATHS
+)
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts='*')
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 app.include_router(router)
 app.mount('/static', StaticFiles(directory=STATIC_ROOT), name='static')
+
+
+@app.exception_handler(TokenStoreBusy)
+async def token_store_busy(_request: Request, exc: TokenStoreBusy) -> JSONResponse:
+    """
+    Every token store connection is in use; ask the client to retry rather than fail
+    """
+
+    logging.warning('%s', exc)
+    return JSONResponse(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        content={'error': 'temporarily_unavailable'},
+        headers={'Retry-After': '1'}
+    )
+
+
+# Compile every template now; with gunicorn's preload_app this happens once, in the
+# master, and the workers share the compiled templates
+warm_templates()
+
+# Per-worker resources; these hold connections, threads or asyncio tasks, so a worker
+# must create its own rather than use any inherited from the master
+PER_WORKER_FACTORIES: 'Tuple[_lru_cache_wrapper[Any], ...]' = (
+    get_token_store,
+    get_session_backend,
+    get_client_metadata_cache,
+    get_profile_cache,
+    get_relme_cache,
+    get_compactor,
+    get_webhook_queue,
+    get_tracer,
+)
+
+
+def import_deferred() -> None:
+    """
+    Import the modules that are otherwise imported on first use; a preloaded gunicorn
+    master does this before forking, so that the workers share them
+    """
+
+    for name in DEFERRED_IMPORTS:
+        importlib.import_module(name)
+
+
+def post_fork() -> None:
+    """
+    Per-worker setup after forking from a preloaded master; forget any per-worker
+    resources the master created, so that startup creates the worker's own
+    """
+
+    for factory in PER_WORKER_FACTORIES:
+        factory.cache_clear()
+
+    discard_http_client()
+
+
+@app.on_event('startup')
+async def startup() -> None:
+    """
+    Per-worker startup; open the token store connection pool and the shared HTTP client,
+    start warming the rel=me cache, compacting the token database and delivering webhooks
+    """
+
+    get_token_store().open()
+    open_http_client()
+    get_relme_cache().start()
+    get_compactor().start()
+    if settings.webhook_server:
+        get_webhook_queue().start()
+
+
+@app.on_event('shutdown')
+async def shutdown() -> None:
+    """
+    Per-worker shutdown; stop the rel=me cache, the compactor and webhook delivery, close
+    the token store connection pool and the shared HTTP client and flush any traces
+    """
+
+    await get_relme_cache().stop()
+    await get_compactor().stop()
+    await get_webhook_queue().stop()
+    get_token_store().close()
+    await close_http_client()
+    get_tracer().shutdown()
@@ -0,0 +1,47 @@
+"""
+IndieAuthify: tests; server import tests
+"""
+
+import json
+import subprocess
+import sys
+
+from indieauthify_server.importtime import DEFERRED_IMPORTS
+
+
+def imported_modules(code: str) -> list:
+    """
+    Run code in a fresh interpreter and return which of the deferred modules it imported
+    """
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            '-c',
+            f'{code}\n'
+            'import json, sys\n'
+            f'print(json.dumps([name for name in {DEFERRED_IMPORTS!r} if name in sys.modules]))'
+        ],
+        capture_output=True,
+        check=False,
+        text=True
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_server_import_defers_heavy_modules() -> None:
+    """
+    Importing the server doesn't import the modules it only needs on first use
+    """
+
+    assert imported_modules('import indieauthify_server.server') == []
+
+
+def test_import_deferred_imports_every_deferred_module() -> None:
+    """
+    A preloaded gunicorn master imports every deferred module before forking
+    """
+
+    code = 'from indieauthify_server.server import import_deferred\nimport_deferred()'
+    assert imported_modules(code) == list(DEFERRED_IMPORTS)